@@ -1,4 +1,5 @@
-from .modify_raster_values import ModifyRasterValuesPlugin
-
+# The plugin is imported lazily so that worker processes can import the
+# engine module of this package without loading QGIS
 def classFactory(iface):
+    from .modify_raster_values import ModifyRasterValuesPlugin
     return ModifyRasterValuesPlugin(iface)
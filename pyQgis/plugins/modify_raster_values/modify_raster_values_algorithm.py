@@ -19,8 +19,10 @@ __author__ = 'Alejandro Usma'
 __date__ = 'November 2022'
 __copyright__ = '(C) 2022, Alejandro Usma'
 
-from math import floor, ceil
+import os
+import uuid
 from numbers import Number
+import numpy as np
 from osgeo import gdal
 
 from PyQt5.QtCore import QCoreApplication
@@ -29,12 +31,27 @@ from qgis.core import (QgsProject,
                        QgsProcessingAlgorithm,
                        QgsProcessingParameterFile,
                        QgsProcessingParameterNumber,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterString,
+                       QgsProcessingParameterDefinition,
                        QgsProcessingParameterFeatureSource,
                        QgsProcessingParameterField,
                        QgsProcessingParameterFileDestination,
+                       QgsRasterLayer,
+                       QgsWkbTypes,
                        QgsCoordinateReferenceSystem,
                        QgsCoordinateTransform,
-                       QgsRasterLayer)
+                       QgsCsException,
+                       QgsFeatureRequest,
+                       QgsFeatureSource,
+                       QgsRectangle)
+from .modify_raster_values_engine import (COMPRESSIONS, OUTPUT_TYPES,
+                                          REDUCERS, RasterGrid, burnBlocks,
+                                          copyRaster, creationOptions,
+                                          radiusCells, rasterizeGeometries,
+                                          reduceCells,
+                                          transformCoords)
 
 
 class ModifyRasterValuesAlgorithm(QgsProcessingAlgorithm):
@@ -44,6 +61,30 @@ class ModifyRasterValuesAlgorithm(QgsProcessingAlgorithm):
     OUTPUT_RASTER = 'OUTPUT_RASTER'
     BAND = 'BAND'
     VALUE_FIELD = 'VALUE_FIELD'
+    REDUCER = 'REDUCER'
+    ALL_TOUCHED = 'ALL_TOUCHED'
+    BURN_MODE = 'BURN_MODE'
+    RADIUS = 'RADIUS'
+    POWER = 'POWER'
+    WRITE_MODE = 'WRITE_MODE'
+    OUTPUT_TYPE = 'OUTPUT_TYPE'
+    PROFILE = 'PROFILE'
+    COMPRESSION = 'COMPRESSION'
+    CREATION_OPTIONS = 'CREATION_OPTIONS'
+
+    # Write modes
+    NEW_RASTER = 0
+    IN_PLACE = 1
+
+    # Burn modes of points
+    BURN_CELL = 0
+    BURN_NEAREST = 1
+    BURN_IDW = 2
+
+    # Output profiles
+    SOURCE_FORMAT = 0
+    TILED_GTIFF = 1
+    COG = 2
 
     def initAlgorithm(self, config=None):
         self.addParameter(
@@ -65,8 +106,8 @@ class ModifyRasterValuesAlgorithm(QgsProcessingAlgorithm):
         self.addParameter(
             QgsProcessingParameterFeatureSource(
                 self.INPUT_POINTS,
-                self.tr('Input point layer'),
-                [QgsProcessing.TypeVectorPoint]
+                self.tr('Input vector layer (points, lines or polygons)'),
+                [QgsProcessing.TypeVectorAnyGeometry]
             )
         )
         
@@ -79,12 +120,116 @@ class ModifyRasterValuesAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
-        # We add a file output of type CSV.
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.REDUCER,
+                self.tr('Value for cells with several points'),
+                options=[self.tr('Last point'), self.tr('First point'),
+                         self.tr('Mean'), self.tr('Minimum'),
+                         self.tr('Maximum'), self.tr('Sum'),
+                         self.tr('Count of points')],
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.BURN_MODE,
+                self.tr('Burn mode of points'),
+                options=[self.tr('Cell under each point'),
+                         self.tr('Nearest point within the radius'),
+                         self.tr('Inverse distance weighting within the radius')],
+                defaultValue=self.BURN_CELL
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.RADIUS,
+                self.tr('Search radius (raster units)'),
+                type=QgsProcessingParameterNumber.Double,
+                defaultValue=0.0,
+                minValue=0.0
+            )
+        )
+
+        power = QgsProcessingParameterNumber(
+            self.POWER,
+            self.tr('Inverse distance weighting power'),
+            type=QgsProcessingParameterNumber.Double,
+            defaultValue=2.0,
+            minValue=0.0
+        )
+        power.setFlags(power.flags() |
+                       QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(power)
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.ALL_TOUCHED,
+                self.tr('Burn all cells touched by lines and polygons'),
+                defaultValue=False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.WRITE_MODE,
+                self.tr('Write mode'),
+                options=[self.tr('Write a modified copy to the output file'),
+                         self.tr('Update the input raster in place')],
+                defaultValue=self.NEW_RASTER
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.OUTPUT_TYPE,
+                self.tr('Output data type'),
+                options=[self.tr('Same as input')] + OUTPUT_TYPES[1:],
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.PROFILE,
+                self.tr('Output profile'),
+                options=[self.tr('Same format as input'),
+                         self.tr('Tiled and compressed GeoTIFF'),
+                         self.tr('Cloud-Optimized GeoTIFF (with overviews)')],
+                defaultValue=self.SOURCE_FORMAT
+            )
+        )
+
+        compression = QgsProcessingParameterEnum(
+            self.COMPRESSION,
+            self.tr('Output compression'),
+            options=COMPRESSIONS,
+            defaultValue=0
+        )
+        compression.setFlags(compression.flags() |
+                             QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(compression)
+
+        options = QgsProcessingParameterString(
+            self.CREATION_OPTIONS,
+            self.tr('Additional creation options (KEY=VALUE separated by spaces)'),
+            defaultValue='',
+            optional=True
+        )
+        options.setFlags(options.flags() |
+                         QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(options)
+
+        # Without an output file the result is kept in memory
         self.addParameter(
             QgsProcessingParameterFileDestination(
                 self.OUTPUT_RASTER,
-                self.tr('Output File'),
+                self.tr('Output File (leave empty to keep the result in memory)'),
                 'TIF files (*.tif)',
+                optional=True,
+                createByDefault=False
             )
         )
 
@@ -94,9 +239,22 @@ class ModifyRasterValuesAlgorithm(QgsProcessingAlgorithm):
         pointLayer = self.parameterAsSource(parameters, self.INPUT_POINTS, context)
         valueField = self.parameterAsFields(parameters, self.VALUE_FIELD, context)
         outPath = self.parameterAsFileOutput(parameters, self.OUTPUT_RASTER, context)
+        reducer = REDUCERS[self.parameterAsEnum(parameters, self.REDUCER, context)]
+        allTouched = self.parameterAsBoolean(parameters, self.ALL_TOUCHED, context)
+        burnMode = self.parameterAsEnum(parameters, self.BURN_MODE, context)
+        radius = self.parameterAsDouble(parameters, self.RADIUS, context)
+        power = self.parameterAsDouble(parameters, self.POWER, context)
+        writeMode = self.parameterAsEnum(parameters, self.WRITE_MODE, context)
+        outType = OUTPUT_TYPES[self.parameterAsEnum(parameters, self.OUTPUT_TYPE, context)]
+        profile = self.parameterAsEnum(parameters, self.PROFILE, context)
+        compression = COMPRESSIONS[self.parameterAsEnum(parameters, self.COMPRESSION, context)]
+        extraOptions = self.parameterAsString(parameters, self.CREATION_OPTIONS, context).split()
 
         # Load data
-        gridLayer = gdal.Open(gridPath)
+        if writeMode == self.IN_PLACE:
+            gridLayer = gdal.Open(gridPath, gdal.GA_Update)
+        else:
+            gridLayer = gdal.Open(gridPath)
         
         if gridLayer is None:
             raise RuntimeError("The path specified in the " \
@@ -106,70 +264,201 @@ class ModifyRasterValuesAlgorithm(QgsProcessingAlgorithm):
                 "'Raster band number' parameter does not match any existing band")
         
         # Get raster information
-        inpBand = gridLayer.GetRasterBand(band)
-        mtrx = inpBand.ReadAsArray()
-        georef = gridLayer.GetGeoTransform()
         proj = gridLayer.GetProjection()
-        rows = gridLayer.RasterYSize
-        cols = gridLayer.RasterXSize
-        clszx = abs(georef[1])
-        clszy = abs(georef[5])
-        if georef[1]<0:
-            xll = georef[0]+georef[1]*cols
+        grid = RasterGrid(gridLayer)
+
+        # Only fetch the value field of the features that may fall on the grid
+        # Points within the search radius of the raster reach its edge cells
+        margin = radius if burnMode != self.BURN_CELL else 0.0
+        request, fieldIndex = self.featureRequest(pointLayer, valueField[0],
+                                                  proj, grid, context, feedback,
+                                                  margin)
+
+        if QgsWkbTypes.geometryType(pointLayer.wkbType()) == QgsWkbTypes.PointGeometry:
+            # Collect the points and convert them to the grid's CRS at once
+            x, y, values = self.collectPoints(pointLayer, request,
+                                              fieldIndex, feedback)
+            x, y = transformCoords(pointLayer.sourceCrs().toWkt(), proj, x, y)
+
+            if burnMode != self.BURN_CELL:
+                if radius <= 0:
+                    raise RuntimeError("The value specified in the 'Search "\
+                        "radius' parameter must be greater than zero")
+                # Spread the values to the cells around the points
+                mode = 'nearest' if burnMode == self.BURN_NEAREST else 'idw'
+                row, col, values = radiusCells(x, y, values, grid, radius,
+                                               mode, power)
+            else:
+                # Locate the points on the grid, leaving out the ones that
+                # fall outside the raster, and reduce the ones that share a cell
+                row, col, inside = grid.cellIndices(x, y)
+                if not inside.all():
+                    feedback.pushInfo(f"{np.count_nonzero(~inside)} points fall "
+                                      f"outside the raster and were skipped")
+                row, col, values = reduceCells(row[inside], col[inside],
+                                               values[inside], grid.cols, reducer)
         else:
-            xll = georef[0]
-        if georef[5]<0:
-            yll = georef[3]+georef[5]*rows
+            # Rasterize lines and polygons with GDAL over the window of the
+            # grid they cover
+            wkbs, values = self.collectGeometries(pointLayer, request,
+                                                  fieldIndex, feedback)
+            row, col, values = rasterizeGeometries(
+                wkbs, values, pointLayer.sourceCrs().toWkt(), proj, grid,
+                allTouched)
+        feedback.pushInfo(f"{row.size} raster cells will be modified")
+
+        # Get the raster to modify: either the input itself or a copy of it
+        # with the requested data type and layout
+        cogPath = None
+        if writeMode == self.IN_PLACE:
+            if outType or profile != self.SOURCE_FORMAT or extraOptions:
+                feedback.pushInfo("The output data type and profile are "
+                                  "ignored when updating the input in place")
+            outGrid = gridLayer
+            outPath = gridPath
         else:
-            yll = georef[3]
-        xur = xll + cols*clszx
-        yur = yll + rows*clszy
+            if not outPath:
+                outPath = f'/vsimem/modify_raster_values/{uuid.uuid4().hex}.tif'
+            # Without an explicit data type every band keeps its own one
+            dataType = gdal.GetDataTypeByName(outType) if outType else None
+            bandType = dataType or gridLayer.GetRasterBand(band).DataType
+            if profile == self.SOURCE_FORMAT:
+                outGrid = copyRaster(gridLayer, outPath,
+                                     gridLayer.GetDriver().ShortName,
+                                     dataType, extraOptions)
+            elif profile == self.TILED_GTIFF:
+                outGrid = copyRaster(gridLayer, outPath, 'GTiff', dataType,
+                                     creationOptions('GTiff', compression,
+                                                     bandType, extraOptions))
+            else:
+                # A COG can not be updated, so the points are burned into a
+                # temporary tiled GeoTIFF that is then translated
+                cogPath = outPath
+                outPath = os.path.splitext(cogPath)[0] + '_tmp.tif'
+                outGrid = copyRaster(gridLayer, outPath, 'GTiff', dataType,
+                                     creationOptions('GTiff', compression,
+                                                     bandType))
+            if outGrid is None:
+                raise RuntimeError("The raster specified in the "\
+                    "'Output File' parameter could not be created")
+        gridLayer = None
 
-        # Set transform to convert the points' CRS to the grid's CRS on the fly
-        pointCrs = pointLayer.sourceCrs()
-        gridCrs = QgsCoordinateReferenceSystem(proj)
-        tr = QgsCoordinateTransform(pointCrs, gridCrs, QgsProject.instance())
+        # Replace raster values with the new values, only touching the
+        # blocks of the raster that hold modified cells
+        outBand = outGrid.GetRasterBand(band)
+        nBlocks = burnBlocks(outBand, row, col, values)
+        feedback.pushInfo(f"{nBlocks} raster blocks were updated")
+        outBand.FlushCache()
+        outGrid = None; outBand = None
+
+        if cogPath is not None:
+            cog = gdal.Translate(cogPath, outPath, format='COG',
+                                 creationOptions=creationOptions(
+                                     'COG', compression, bandType, extraOptions))
+            if cog is None:
+                raise RuntimeError("The raster specified in the "\
+                    "'Output File' parameter could not be created")
+            cog = None
+            gdal.GetDriverByName('GTiff').Delete(outPath)
+            outPath = cogPath
+        
+        # Load the modified layer to the QGIS GUI
+        outLayer = QgsRasterLayer(outPath, 'modified_raster', 'gdal')
+        if outPath.startswith('/vsimem/'):
+            # Free the in-memory raster with the layer that reads it
+            outLayer.willBeDeleted.connect(lambda: gdal.Unlink(outPath))
+        QgsProject.instance().addMapLayer(outLayer)
+        return {self.OUTPUT_RASTER: outLayer}
+
+    def featureRequest(self, layer, valueField, proj, grid, context, feedback,
+                       margin=0.0):
+        """Builds the request of the features that may fall on the grid.
+
+        Only the value field is fetched, and the features are filtered by
+        the extent of the grid, grown by margin (in grid units), transformed
+        to the CRS of the layer, unless the grid is None. Returns the
+        request and the index of the value field.
+        """
+        fieldIndex = layer.fields().lookupField(valueField)
+        if fieldIndex < 0:
+            raise RuntimeError("The value specified in the 'Field that "\
+                "stores the desired values' parameter does not match any field")
+        request = QgsFeatureRequest()
+        request.setSubsetOfAttributes([fieldIndex])
+
+        extent = None
+        if grid is not None:
+            extent = QgsRectangle(grid.xll - margin, grid.yll - margin,
+                                  grid.xur + margin, grid.yur + margin)
+            gridCrs = QgsCoordinateReferenceSystem.fromWkt(proj)
+            if gridCrs.isValid() and gridCrs != layer.sourceCrs():
+                try:
+                    transform = QgsCoordinateTransform(gridCrs, layer.sourceCrs(),
+                                                       context.transformContext())
+                    extent = transform.transformBoundingBox(extent)
+                except QgsCsException:
+                    extent = None
+        if extent is not None:
+            request.setFilterRect(extent)
+            if layer.hasSpatialIndex() == QgsFeatureSource.SpatialIndexNotPresent:
+                feedback.pushInfo("The vector layer has no spatial index, "
+                                  "creating one would speed up the extent filter")
+        return request, fieldIndex
+
+    def collectPoints(self, pointLayer, request, fieldIndex, feedback):
+        """Returns the coordinates and values of the points as arrays.
+
+        Features whose value is not a number are skipped, and every part
+        of a multipoint gets the value of its feature.
+        """
+        xs = []
+        ys = []
+        values = []
 
         # Compute the number of steps to display within the progress bar and
         # get features from source
         total = 100.0 / pointLayer.featureCount() if pointLayer.featureCount() else 0
         
         # Iterate over the point layer features
-        for current, p in enumerate(pointLayer.getFeatures()):
+        for current, p in enumerate(pointLayer.getFeatures(request)):
             
             # Stop the algorithm if cancel button has been clicked
             if feedback.isCanceled(): break
             
-            # Replace raster values with point values
+            value = p.attribute(fieldIndex)
             geom = p.geometry()
-            geom.transform(tr)
-            x = geom.asPoint().x()
-            y = geom.asPoint().y()
-            col = int(floor((x - xll) / clszx))
-            row = int(rows - ceil((y - yll) / clszy))
-            value = p[valueField[0]]
-            if isinstance(value, Number):
-                mtrx[row][col] = value
+            if isinstance(value, Number) and not geom.isEmpty():
+                if geom.isMultipart():
+                    points = geom.asMultiPoint()
+                else:
+                    points = [geom.asPoint()]
+                for point in points:
+                    xs.append(point.x())
+                    ys.append(point.y())
+                    values.append(value)
 
             # Update the progress bar
             feedback.setProgress(int(current * total))
 
-        # Export modified layer
-        driver = gridLayer.GetDriver()
-        outGrid = driver.Create(outPath, cols, rows, 1, gdal.GDT_Float32)
-        outBand = outGrid.GetRasterBand(1)
-        outGrid.SetGeoTransform((xll, clszx, 0.0, yur, 0.0, -clszy))
-        outGrid.SetProjection(proj)
-        band = outGrid.GetRasterBand(1)
-        band.SetNoDataValue(inpBand.GetNoDataValue())
-        band.WriteArray(mtrx, 0, 0)
-        band.FlushCache()
-        outGrid = None; band = None
-        
-        # Load the modified layer to the QGIS GUI
-        outLayer = QgsRasterLayer(outPath, 'modified_raster', 'gdal')
-        QgsProject.instance().addMapLayer(outLayer)
-        return {self.OUTPUT_RASTER: outLayer}
+        return np.array(xs), np.array(ys), np.array(values, dtype=np.float64)
+
+    def collectGeometries(self, layer, request, fieldIndex, feedback):
+        """Returns the geometries of the features as WKB and their values.
+
+        Features whose value is not a number are skipped.
+        """
+        wkbs = []
+        values = []
+        total = 100.0 / layer.featureCount() if layer.featureCount() else 0
+        for current, f in enumerate(layer.getFeatures(request)):
+            if feedback.isCanceled(): break
+            value = f.attribute(fieldIndex)
+            geom = f.geometry()
+            if isinstance(value, Number) and not geom.isEmpty():
+                wkbs.append(bytes(geom.asWkb()))
+                values.append(value)
+            feedback.setProgress(int(current * total))
+        return wkbs, values
 
     def name(self):
         return 'modify_raster_values'
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+#
+# ***************************************************************************
+#     modify_raster_values_batch_algorithm.py
+#     ----------------
+#     Date                 : October 2026
+#     Copyright            : (C) 2026 by Alejandro Usma
+#     Email                : causmar97@gmail.com
+# ***************************************************************************
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation; either version 2 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# ***************************************************************************
+
+__author__ = 'Alejandro Usma'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2026, Alejandro Usma'
+
+import csv
+import fnmatch
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, wait
+from types import SimpleNamespace
+from osgeo import gdal
+
+from qgis.core import (QgsProcessing,
+                       QgsProcessingParameterMultipleLayers,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterString,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterField,
+                       QgsProcessingParameterFolderDestination,
+                       QgsProcessingParameterFileDestination)
+from .modify_raster_values_algorithm import ModifyRasterValuesAlgorithm
+from .modify_raster_values_engine import (REDUCERS, RasterGrid,
+                                          burnRasterJob, transformCoords)
+
+
+def pythonExecutable():
+    """Returns the Python interpreter to spawn the worker processes with.
+
+    Inside QGIS sys.executable is the QGIS binary, not a Python interpreter,
+    so the interpreter of the QGIS installation is looked for. Returns None
+    if it is not found.
+    """
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        return sys.executable
+    if sys.platform == 'win32':
+        names = ['pythonw.exe', 'python.exe']
+        folders = [sys.exec_prefix]
+    else:
+        names = [f'python{sys.version_info[0]}.{sys.version_info[1]}',
+                 f'python{sys.version_info[0]}']
+        # On macOS the interpreter is in the bin folder of the app bundle
+        folders = [os.path.join(sys.exec_prefix, 'bin'),
+                   os.path.join(os.path.dirname(sys.executable), 'bin')]
+    for folder in folders:
+        for name in names:
+            python = os.path.join(folder, name)
+            if os.path.isfile(python):
+                return python
+    return None
+
+
+def processPool(workers):
+    """Returns a process pool whose workers can import the engine module.
+
+    The folder that holds the plugin package is added to the import path of
+    the spawned processes, which only import the QGIS-free engine.
+    """
+    python = pythonExecutable()
+    if python is None:
+        raise RuntimeError("No Python interpreter was found to start the "
+                           "worker processes")
+    pluginsDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    pythonPath = os.environ.get('PYTHONPATH', '').split(os.pathsep)
+    if pluginsDir not in pythonPath:
+        os.environ['PYTHONPATH'] = os.pathsep.join([pluginsDir] + pythonPath)
+    ctx = multiprocessing.get_context('spawn')
+    ctx.set_executable(python)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+
+
+class ModifyRasterValuesBatchAlgorithm(ModifyRasterValuesAlgorithm):
+    """Modifies the values of many rasters or tiles using a point layer."""
+    INPUT_RASTERS = 'INPUT_RASTERS'
+    INPUT_FOLDER = 'INPUT_FOLDER'
+    PATTERN = 'PATTERN'
+    WORKERS = 'WORKERS'
+    OUTPUT_FOLDER = 'OUTPUT_FOLDER'
+    REPORT = 'REPORT'
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterMultipleLayers(
+                self.INPUT_RASTERS,
+                self.tr('Input raster layers'),
+                QgsProcessing.TypeRaster,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.INPUT_FOLDER,
+                self.tr('Folder with input rasters'),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.PATTERN,
+                self.tr('File pattern of the rasters in the folder'),
+                defaultValue='*.tif'
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                 self.BAND,
+                 self.tr('Raster band number'),
+                 type=QgsProcessingParameterNumber.Integer,
+                 defaultValue = 1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT_POINTS,
+                self.tr('Input point layer'),
+                [QgsProcessing.TypeVectorPoint]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.VALUE_FIELD,
+                self.tr('Field that stores the desired values'),
+                None,
+                self.INPUT_POINTS
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.REDUCER,
+                self.tr('Value for cells with several points'),
+                options=[self.tr('Last point'), self.tr('First point'),
+                         self.tr('Mean'), self.tr('Minimum'),
+                         self.tr('Maximum'), self.tr('Sum'),
+                         self.tr('Count of points')],
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.WRITE_MODE,
+                self.tr('Write mode'),
+                options=[self.tr('Write modified copies to the output folder'),
+                         self.tr('Update the input rasters in place')],
+                defaultValue=self.NEW_RASTER
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.WORKERS,
+                self.tr('Number of worker processes'),
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=max(os.cpu_count() or 1, 1),
+                minValue=1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT_FOLDER,
+                self.tr('Output folder')
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                self.REPORT,
+                self.tr('Report'),
+                'CSV files (*.csv)',
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        rasterLayers = self.parameterAsLayerList(parameters, self.INPUT_RASTERS, context)
+        folder = self.parameterAsFile(parameters, self.INPUT_FOLDER, context)
+        pattern = self.parameterAsString(parameters, self.PATTERN, context)
+        band = self.parameterAsInt(parameters, self.BAND, context)
+        pointLayer = self.parameterAsSource(parameters, self.INPUT_POINTS, context)
+        valueField = self.parameterAsFields(parameters, self.VALUE_FIELD, context)
+        reducer = REDUCERS[self.parameterAsEnum(parameters, self.REDUCER, context)]
+        writeMode = self.parameterAsEnum(parameters, self.WRITE_MODE, context)
+        workers = self.parameterAsInt(parameters, self.WORKERS, context)
+        outFolder = self.parameterAsString(parameters, self.OUTPUT_FOLDER, context)
+        reportPath = self.parameterAsFileOutput(parameters, self.REPORT, context)
+
+        # List the rasters of the batch
+        paths = [layer.source() for layer in rasterLayers]
+        if folder:
+            paths += [os.path.join(folder, name)
+                      for name in sorted(os.listdir(folder))
+                      if fnmatch.fnmatch(name.lower(), pattern.lower())]
+        # A raster given twice would be modified twice
+        unique = {}
+        for path in paths:
+            unique.setdefault(os.path.normcase(os.path.normpath(path)), path)
+        paths = list(unique.values())
+        if not paths:
+            raise RuntimeError("No rasters were given in the 'Input raster "\
+                "layers' or 'Folder with input rasters' parameters")
+
+        # Read the georeferencing of every raster
+        grids = []
+        for path in paths:
+            dataset = gdal.Open(path)
+            if dataset is None:
+                raise RuntimeError(f"The raster '{path}' could not be opened")
+            grids.append((RasterGrid(dataset), dataset.GetProjection()))
+            dataset = None
+
+        # Only request the points within the rasters, when they share a CRS
+        projs = {proj for grid, proj in grids}
+        if len(projs) == 1:
+            extent = SimpleNamespace(xll=min(g.xll for g, p in grids),
+                                     yll=min(g.yll for g, p in grids),
+                                     xur=max(g.xur for g, p in grids),
+                                     yur=max(g.yur for g, p in grids))
+        else:
+            extent = None
+        request, fieldIndex = self.featureRequest(
+            pointLayer, valueField[0], grids[0][1], extent, context, feedback)
+        x, y, values = self.collectPoints(pointLayer, request, fieldIndex,
+                                          feedback)
+        if feedback.isCanceled():
+            return {}
+
+        # Route every point only to the rasters whose extent contains it
+        jobs = []
+        layerWkt = pointLayer.sourceCrs().toWkt()
+        transformed = {}
+        outputs = set()
+        for path, (grid, proj) in zip(paths, grids):
+            if proj not in transformed:
+                transformed[proj] = transformCoords(layerWkt, proj, x, y)
+            tx, ty = transformed[proj]
+            inside = grid.cellIndices(tx, ty)[2]
+            if writeMode == self.IN_PLACE:
+                output = None
+            else:
+                # Rasters with the same name in different folders get a
+                # numbered suffix instead of overwriting each other
+                name, extension = os.path.splitext(os.path.basename(path))
+                output = os.path.join(outFolder, name + extension)
+                number = 1
+                while os.path.normcase(output) in outputs:
+                    number += 1
+                    output = os.path.join(outFolder,
+                                          f'{name}_{number}{extension}')
+                outputs.add(os.path.normcase(output))
+            jobs.append({'input': path, 'output': output, 'band': band,
+                         'reducer': reducer, 'x': tx[inside], 'y': ty[inside],
+                         'values': values[inside]})
+
+        # Burn the points of every raster in parallel
+        os.makedirs(outFolder, exist_ok=True)
+        report = {}
+        with processPool(min(workers, len(jobs))) as pool:
+            pending = {pool.submit(burnRasterJob, job): job for job in jobs}
+            while pending:
+                finished, _ = wait(pending, timeout=0.5)
+                for future in finished:
+                    job = pending.pop(future)
+                    try:
+                        report[job['input']] = future.result()
+                    except Exception as e:
+                        report[job['input']] = {'error': str(e)}
+                        feedback.reportError(str(e))
+                feedback.setProgress(int(100.0 * len(report) / len(jobs)))
+
+                # Stop submitting rasters if cancel button has been clicked;
+                # the rasters being modified are finished
+                if feedback.isCanceled():
+                    for future in pending:
+                        future.cancel()
+                    break
+
+        # Write the report of the batch
+        with open(reportPath, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['raster', 'output', 'points', 'cells',
+                             'blocks', 'error'])
+            for job in jobs:
+                result = report.get(job['input'], {'error': 'cancelled'})
+                writer.writerow([job['input'], job['output'] or job['input'],
+                                 result.get('points', ''),
+                                 result.get('cells', ''),
+                                 result.get('blocks', ''),
+                                 result.get('error', '')])
+
+        return {self.OUTPUT_FOLDER: outFolder, self.REPORT: reportPath}
+
+    def name(self):
+        return 'modify_raster_values_batch'
+
+    def displayName(self):
+        return self.tr('Modify Raster Values From Points (Batch)')
+
+    def createInstance(self):
+        return ModifyRasterValuesBatchAlgorithm()
@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+#
+# ***************************************************************************
+#     modify_raster_values_engine.py
+#     ----------------
+#     Date                 : October 2026
+#     Copyright            : (C) 2026 by Alejandro Usma
+#     Email                : causmar97@gmail.com
+# ***************************************************************************
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation; either version 2 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# ***************************************************************************
+
+__author__ = 'Alejandro Usma'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2026, Alejandro Usma'
+
+import numpy as np
+from osgeo import gdal, ogr, osr
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# Data types offered for the output, 'None' keeps the one of the source
+OUTPUT_TYPES = [None, 'Byte', 'Int16', 'UInt16', 'Int32', 'UInt32',
+                'Float32', 'Float64']
+COMPRESSIONS = ['DEFLATE', 'ZSTD', 'LZW', 'NONE']
+REDUCERS = ['last', 'first', 'mean', 'min', 'max', 'sum', 'count']
+
+# Size of the in-memory windows in which lines and polygons are rasterized
+RASTERIZE_TILE = 4096
+
+# Number of cells evaluated at once by the radius burn
+RADIUS_CHUNK = 512 * 512
+
+# Number of points sent at once to TransformPoints, which takes and returns
+# Python lists
+TRANSFORM_CHUNK = 65536
+
+
+def transformCoords(srcWkt, dstWkt, x, y):
+    """Transforms arrays of coordinates between two CRS.
+
+    The points go to GDAL in chunks of TRANSFORM_CHUNK. If either CRS is
+    undefined the coordinates are returned unchanged.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if x.size == 0 or not srcWkt or not dstWkt:
+        return x, y
+    srcSrs = osr.SpatialReference()
+    srcSrs.ImportFromWkt(srcWkt)
+    dstSrs = osr.SpatialReference()
+    dstSrs.ImportFromWkt(dstWkt)
+    if srcSrs.IsSame(dstSrs):
+        return x, y
+
+    # Keep the x/y axis order regardless of the CRS definitions
+    srcSrs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    dstSrs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    ct = osr.CoordinateTransformation(srcSrs, dstSrs)
+    tx = np.empty(x.size)
+    ty = np.empty(y.size)
+    for i in range(0, x.size, TRANSFORM_CHUNK):
+        coords = np.column_stack((x[i:i + TRANSFORM_CHUNK],
+                                  y[i:i + TRANSFORM_CHUNK]))
+        out = np.asarray(ct.TransformPoints(coords.tolist()))
+        tx[i:i + len(out)] = out[:, 0]
+        ty[i:i + len(out)] = out[:, 1]
+    return tx, ty
+
+
+class RasterGrid:
+    """Georeferencing of a GDAL raster, as used to locate points on it."""
+
+    def __init__(self, dataset):
+        georef = dataset.GetGeoTransform()
+        self.rows = dataset.RasterYSize
+        self.cols = dataset.RasterXSize
+        self.clszx = abs(georef[1])
+        self.clszy = abs(georef[5])
+        if georef[1]<0:
+            self.xll = georef[0]+georef[1]*self.cols
+        else:
+            self.xll = georef[0]
+        if georef[5]<0:
+            self.yll = georef[3]+georef[5]*self.rows
+        else:
+            self.yll = georef[3]
+        self.xur = self.xll + self.cols*self.clszx
+        self.yur = self.yll + self.rows*self.clszy
+
+    def cellIndices(self, x, y):
+        """Returns the rows and columns of the cells under the points.
+
+        The third array returned is True for the points that fall inside
+        the raster; the indices of the other points are meaningless.
+        """
+        col = np.floor((np.asarray(x) - self.xll) / self.clszx)
+        row = self.rows - np.ceil((np.asarray(y) - self.yll) / self.clszy)
+        inside = (row >= 0) & (row < self.rows) & \
+                 (col >= 0) & (col < self.cols)
+        row = np.where(inside, row, 0).astype(np.int64)
+        col = np.where(inside, col, 0).astype(np.int64)
+        return row, col, inside
+
+
+def reduceCells(row, col, values, cols, reducer='last'):
+    """Reduces the values of the points that fall in the same cell.
+
+    The reducer is one of REDUCERS; 'last' and 'first' follow the order of
+    the points. Returns the rows, columns and values of the distinct cells.
+    """
+    row = np.asarray(row, dtype=np.int64)
+    col = np.asarray(col, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    cells = row * cols + col
+    if reducer == 'last':
+        # The first occurrence in the reversed order is the last one
+        cells, index = np.unique(cells[::-1], return_index=True)
+        reduced = values[::-1][index]
+    elif reducer == 'first':
+        cells, index = np.unique(cells, return_index=True)
+        reduced = values[index]
+    else:
+        cells, inverse, counts = np.unique(cells, return_inverse=True,
+                                           return_counts=True)
+        if reducer == 'count':
+            reduced = counts.astype(np.float64)
+        elif reducer in ('sum', 'mean'):
+            reduced = np.bincount(inverse, weights=values,
+                                  minlength=cells.size)
+            if reducer == 'mean':
+                reduced /= counts
+        elif reducer in ('min', 'max'):
+            ufunc = np.minimum if reducer == 'min' else np.maximum
+            reduced = np.full(cells.size, np.inf if reducer == 'min' else -np.inf)
+            ufunc.at(reduced, inverse, values)
+        else:
+            raise ValueError(f"Unknown reducer '{reducer}'")
+    return cells // cols, cells % cols, reduced
+
+
+def rasterizeGeometries(wkbs, values, srcWkt, dstWkt, grid, allTouched=False):
+    """Rasterizes geometries on a grid with GDAL and returns the burned cells.
+
+    The geometries, given as WKB, are burned with their value in the order
+    given, so the last one wins where they overlap. Only the window of the
+    grid covered by the geometries is rasterized, in tiles of at most
+    RASTERIZE_TILE cells a side, and the tiles that no geometry crosses are
+    skipped. Returns the rows, columns and values of the burned cells.
+    """
+    empty = np.empty(0, dtype=np.int64)
+    if not wkbs:
+        return empty, empty, np.empty(0)
+
+    # Copy the geometries to an OGR memory layer in the grid's CRS, as they
+    # are if either CRS is undefined
+    srcSrs = osr.SpatialReference()
+    srcSrs.ImportFromWkt(srcWkt)
+    dstSrs = osr.SpatialReference()
+    dstSrs.ImportFromWkt(dstWkt)
+    srcSrs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    dstSrs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    ct = None
+    if srcWkt and dstWkt and not srcSrs.IsSame(dstSrs):
+        ct = osr.CoordinateTransformation(srcSrs, dstSrs)
+    source = ogr.GetDriverByName('Memory').CreateDataSource('')
+    layer = source.CreateLayer('burn', dstSrs if dstWkt else None,
+                               ogr.wkbUnknown)
+    layer.CreateField(ogr.FieldDefn('value', ogr.OFTReal))
+    for wkb, value in zip(wkbs, values):
+        geom = ogr.CreateGeometryFromWkb(wkb)
+        if ct is not None:
+            geom.Transform(ct)
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetGeometry(geom)
+        feature.SetField('value', float(value))
+        layer.CreateFeature(feature)
+
+    # Window of the grid covered by the geometries
+    xmin, xmax, ymin, ymax = layer.GetExtent()
+    col0 = max(int(np.floor((xmin - grid.xll) / grid.clszx)), 0)
+    col1 = min(int(np.ceil((xmax - grid.xll) / grid.clszx)) + 1, grid.cols)
+    row0 = max(int(np.floor((grid.yur - ymax) / grid.clszy)), 0)
+    row1 = min(int(np.ceil((grid.yur - ymin) / grid.clszy)) + 1, grid.rows)
+
+    options = ['ATTRIBUTE=value']
+    if allTouched:
+        options.append('ALL_TOUCHED=TRUE')
+    memDriver = gdal.GetDriverByName('MEM')
+    rows, cols, burned = [], [], []
+    for r in range(row0, row1, RASTERIZE_TILE):
+        for c in range(col0, col1, RASTERIZE_TILE):
+            height = min(RASTERIZE_TILE, row1 - r)
+            width = min(RASTERIZE_TILE, col1 - c)
+            layer.SetSpatialFilterRect(grid.xll + c*grid.clszx,
+                                       grid.yur - (r + height)*grid.clszy,
+                                       grid.xll + (c + width)*grid.clszx,
+                                       grid.yur - r*grid.clszy)
+            if layer.GetFeatureCount() == 0:
+                continue
+            tile = memDriver.Create('', width, height, 1, gdal.GDT_Float64)
+            tile.SetGeoTransform((grid.xll + c*grid.clszx, grid.clszx, 0.0,
+                                  grid.yur - r*grid.clszy, 0.0, -grid.clszy))
+            tile.SetProjection(dstWkt)
+            tileBand = tile.GetRasterBand(1)
+            tileBand.Fill(np.nan)
+            gdal.RasterizeLayer(tile, [1], layer, options=options)
+            data = tileBand.ReadAsArray()
+            tileRows, tileCols = np.nonzero(~np.isnan(data))
+            rows.append(tileRows + r)
+            cols.append(tileCols + c)
+            burned.append(data[tileRows, tileCols])
+            tile = None
+    layer.SetSpatialFilter(None)
+    if not rows:
+        return empty, empty, np.empty(0)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(burned)
+
+
+def radiusCells(x, y, values, grid, radius, mode='nearest', power=2.0):
+    """Spreads point values to the cells whose centre is within a radius.
+
+    With mode 'nearest' a cell takes the value of its nearest point, and
+    with 'idw' the inverse distance weighted mean of the points within the
+    radius. Only the cells in the window of some point, the square that
+    bounds its radius, are evaluated, in chunks of RADIUS_CHUNK cells.
+    Returns the rows, columns and values of the cells reached.
+    """
+    if cKDTree is None:
+        raise RuntimeError("The radius burn requires scipy, which is not installed")
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    empty = np.empty(0, dtype=np.int64)
+    if x.size == 0:
+        return empty, empty, np.empty(0)
+    tree = cKDTree(np.column_stack((x, y)))
+
+    # Window of cells around every point, clipped to the grid
+    def cellRange(start, coord, size, count, sign):
+        first = np.floor(sign * (coord - start) / size - radius / size)
+        last = np.floor(sign * (coord - start) / size + radius / size)
+        return np.clip(first, 0, count - 1).astype(np.int64), \
+               np.clip(last, 0, count - 1).astype(np.int64), \
+               (last >= 0) & (first < count)
+    c0, c1, okx = cellRange(grid.xll, x, grid.clszx, grid.cols, 1)
+    r0, r1, oky = cellRange(grid.yur, y, grid.clszy, grid.rows, -1)
+    ok = okx & oky
+    order = np.lexsort((c0[ok], r0[ok]))
+    r0, r1, c0, c1 = r0[ok][order], r1[ok][order], c0[ok][order], c1[ok][order]
+
+    # Flat indices of the cells of the windows, merged where windows
+    # overlap; nearby points are taken together so that their windows are
+    # merged before they are kept
+    widths = c1 - c0 + 1
+    sizes = (r1 - r0 + 1) * widths
+    ends = np.cumsum(sizes)
+    def sortedUnique(a):
+        a = np.sort(a)
+        return a[np.append(True, a[1:] != a[:-1])] if a.size else a
+    cells = []
+    first = 0
+    while first < sizes.size:
+        last = max(int(np.searchsorted(ends, ends[first] - sizes[first] +
+                                       RADIUS_CHUNK, side='right')), first + 1)
+        n = sizes[first:last]
+        local = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        w = np.repeat(widths[first:last], n)
+        cellRows = np.repeat(r0[first:last], n) + local // w
+        cellCols = np.repeat(c0[first:last], n) + local % w
+        cells.append(sortedUnique(cellRows * grid.cols + cellCols))
+        first = last
+    cells = sortedUnique(np.concatenate(cells)) if cells else empty
+
+    rows, cols, burned = [], [], []
+    for start in range(0, cells.size, RADIUS_CHUNK):
+        chunkRows = cells[start:start + RADIUS_CHUNK] // grid.cols
+        chunkCols = cells[start:start + RADIUS_CHUNK] % grid.cols
+        centres = np.column_stack((grid.xll + (chunkCols + 0.5) * grid.clszx,
+                                   grid.yur - (chunkRows + 0.5) * grid.clszy))
+        if mode == 'nearest':
+            dist, nearest = tree.query(centres, distance_upper_bound=radius)
+            reached = np.isfinite(dist)
+            cellValues = values[nearest[reached]]
+        else:
+            # Pairs of points and cell centres within the radius
+            pairs = tree.sparse_distance_matrix(cKDTree(centres), radius,
+                                                output_type='ndarray')
+            dist = np.maximum(pairs['v'], 1e-12 * radius)
+            weights = dist ** -power
+            sumWeights = np.bincount(pairs['j'], weights=weights,
+                                     minlength=centres.shape[0])
+            sumValues = np.bincount(pairs['j'], weights=weights * values[pairs['i']],
+                                    minlength=centres.shape[0])
+            reached = sumWeights > 0
+            cellValues = sumValues[reached] / sumWeights[reached]
+        rows.append(chunkRows[reached])
+        cols.append(chunkCols[reached])
+        burned.append(cellValues)
+    if not rows:
+        return empty, empty, np.empty(0)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(burned)
+
+
+def burnBlocks(band, row, col, values):
+    """Writes values to the given cells of a band, block by block.
+
+    Only the native blocks of the band that contain at least one cell are
+    read, modified and written back. When a cell is given more than once,
+    the last value wins. On integer bands the values are rounded and
+    clipped to the range of the data type. Returns the number of blocks
+    touched.
+    """
+    row = np.asarray(row, dtype=np.int64)
+    col = np.asarray(col, dtype=np.int64)
+    values = np.asarray(values)
+    if row.size == 0:
+        return 0
+    blockX, blockY = band.GetBlockSize()
+    nBlocksX = -(-band.XSize // blockX)
+
+    # Group the cells by block, keeping their order inside each block
+    blockIds = (row // blockY) * nBlocksX + col // blockX
+    order = np.argsort(blockIds, kind='stable')
+    ids, starts = np.unique(blockIds[order], return_index=True)
+    ends = np.append(starts[1:], order.size)
+
+    for blockId, start, end in zip(ids, starts, ends):
+        sel = order[start:end]
+        yoff = int(blockId // nBlocksX) * blockY
+        xoff = int(blockId % nBlocksX) * blockX
+        width = min(blockX, band.XSize - xoff)
+        height = min(blockY, band.YSize - yoff)
+        data = band.ReadAsArray(xoff, yoff, width, height)
+        blockValues = values[sel]
+        if np.issubdtype(data.dtype, np.integer):
+            limits = np.iinfo(data.dtype)
+            blockValues = np.clip(np.rint(blockValues), limits.min, limits.max)
+        data[row[sel] - yoff, col[sel] - xoff] = blockValues
+        band.WriteArray(data, xoff, yoff)
+    return len(ids)
+
+
+def creationOptions(driverName, compression, dataType, extraOptions=()):
+    """Builds the creation options of a tiled, compressed GTiff or COG.
+
+    The predictor follows the data type: horizontal differencing for
+    integers and floating point prediction for reals. Any extra
+    'KEY=VALUE' option replaces the default of the same key, since GDAL
+    only reads the first value of a key.
+    """
+    isFloat = gdal.GetDataTypeName(dataType).startswith(('Float', 'CFloat'))
+    if driverName == 'COG':
+        options = ['BLOCKSIZE=512', 'OVERVIEWS=AUTO']
+        predictor = 'FLOATING_POINT' if isFloat else 'STANDARD'
+    else:
+        options = ['TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512']
+        predictor = '3' if isFloat else '2'
+    options += ['BIGTIFF=IF_SAFER', f'COMPRESS={compression}']
+    if compression != 'NONE':
+        options.append(f'PREDICTOR={predictor}')
+
+    # Merge by key, keeping the order of the defaults
+    merged = {option.split('=', 1)[0].upper(): option for option in options}
+    for option in extraOptions:
+        merged[option.split('=', 1)[0].upper()] = option
+    return list(merged.values())
+
+
+def copyRaster(dataset, path, driverName, dataType=None, options=()):
+    """Copies a raster with all its bands and returns it open for update.
+
+    The data type of the source is kept unless another one is given.
+    """
+    copy = gdal.Translate(path, dataset, format=driverName,
+                          outputType=dataType or gdal.GDT_Unknown,
+                          creationOptions=list(options))
+    if copy is None:
+        return None
+    copy = None
+    return gdal.Open(path, gdal.GA_Update)
+
+
+def burnRasterJob(job):
+    """Burns points into one raster of a batch; runs in a worker process.
+
+    The job is a dict with the input raster, the output raster (None to
+    update the input in place), the band, the reducer and the x, y and
+    value arrays of the points in the raster's CRS. Returns a dict with the
+    counts reported for the raster.
+    """
+    if job['output'] is None:
+        dataset = gdal.Open(job['input'], gdal.GA_Update)
+    else:
+        source = gdal.Open(job['input'])
+        dataset = None
+        if source is not None:
+            dataset = copyRaster(source, job['output'],
+                                 source.GetDriver().ShortName)
+        source = None
+    if dataset is None:
+        raise RuntimeError(f"The raster '{job['input']}' could not be opened")
+    if job['band'] <= 0 or job['band'] > dataset.RasterCount:
+        raise RuntimeError(f"The raster '{job['input']}' has no band {job['band']}")
+
+    grid = RasterGrid(dataset)
+    row, col, inside = grid.cellIndices(job['x'], job['y'])
+    row, col, values = reduceCells(row[inside], col[inside],
+                                   job['values'][inside], grid.cols,
+                                   job['reducer'])
+    band = dataset.GetRasterBand(job['band'])
+    nBlocks = burnBlocks(band, row, col, values)
+    band.FlushCache()
+    band = None; dataset = None
+    return {'points': int(np.count_nonzero(inside)), 'cells': int(row.size),
+            'blocks': nBlocks}
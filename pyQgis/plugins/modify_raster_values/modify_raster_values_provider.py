@@ -4,6 +4,7 @@ from PyQt5.QtGui import QIcon
 
 from qgis.core import QgsProcessingProvider
 from .modify_raster_values_algorithm import ModifyRasterValuesAlgorithm
+from .modify_raster_values_batch_algorithm import ModifyRasterValuesBatchAlgorithm
 
 
 class ModifyRasterValuesProvider(QgsProcessingProvider):
@@ -16,6 +17,7 @@ class ModifyRasterValuesProvider(QgsProcessingProvider):
 
     def loadAlgorithms(self):
         self.addAlgorithm(ModifyRasterValuesAlgorithm())
+        self.addAlgorithm(ModifyRasterValuesBatchAlgorithm())
 
     def id(self):
         return 'modify_raster_values'
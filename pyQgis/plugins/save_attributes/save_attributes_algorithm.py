@@ -1,14 +1,106 @@
-from PyQt5.QtCore import QCoreApplication
-from qgis.core import (QgsProcessing,
+import csv
+import os
+from functools import partial
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from PyQt5.QtCore import (QCoreApplication, QByteArray, QDate, QDateTime,
+                          QTime, QVariant, Qt)
+from qgis.core import (QgsExpression,
+                       QgsFeatureRequest,
+                       QgsProcessing,
                        QgsProcessingAlgorithm,
+                       QgsProcessingFeatureSourceDefinition,
+                       QgsProcessingParameterEnum,
                        QgsProcessingParameterFeatureSource,
-                       QgsProcessingParameterFileDestination)
+                       QgsProcessingParameterField,
+                       QgsProcessingParameterFileDestination,
+                       QgsProcessingParameterNumber,
+                       QgsVectorLayer)
+from .save_attributes_compression import (COMPRESSIONS, EXTENSIONS,
+                                          MAX_LEVELS, compressionOf, openText,
+                                          splitExtension)
+from .save_attributes_columnar import FORMATS, pa, writeArrow, writeNpz
+from .save_attributes_incremental import (deltaPath, diffRows, fullExport,
+                                          patchCsv, readManifest, writeDelta)
+
+# Size of the buffer of the output file
+BUFFER_SIZE = 8 * 1024 * 1024
+
+# Number of features between progress updates
+PROGRESS_STEP = 10000
+
+# Attribute types that the CSV writer handles by itself
+PLAIN_TYPES = (str, int, float)
+
+
+def csvValue(value):
+    """Converts an attribute value that is not a plain Python type."""
+    if isinstance(value, QVariant):
+        # NULL attributes are QVariant instances
+        return '' if value.isNull() else value.value()
+    if isinstance(value, (QDate, QDateTime, QTime)):
+        return value.toString(Qt.ISODate) if value.isValid() else ''
+    if isinstance(value, QByteArray):
+        return bytes(value).hex()
+    return value
+
+
+def attributeRows(features, indices, feedback, progress):
+    """Yields the FID and the CSV values of the attributes of every feature.
+
+    Every PROGRESS_STEP features the cancel button is checked and the
+    number of features read since the last call is passed to progress.
+    """
+    for current, f in enumerate(features):
+        if current % PROGRESS_STEP == 0:
+            # Stop the algorithm if cancel button has been clicked
+            if feedback.isCanceled():
+                break
+            if current:
+                progress(PROGRESS_STEP)
+        attributes = f.attributes()
+        yield f.id(), [v if type(v) in PLAIN_TYPES else csvValue(v)
+                       for v in (attributes[i] for i in indices)]
+
+
+def writeCsv(path, fieldnames, indices, features, feedback, progress,
+             opener=openText):
+    """Writes the attributes of the features to a CSV file.
+
+    The file is opened with opener, which may compress it.
+    """
+    with opener(path) as outputFile:
+        writer = csv.writer(outputFile)
+        if fieldnames is not None:
+            writer.writerow(fieldnames)
+        writer.writerows(values for fid, values in
+                         attributeRows(features, indices, feedback, progress))
 
 
 class SaveAttributesAlgorithm(QgsProcessingAlgorithm):
     """Saves the attributes of a vector layer to a CSV file."""
     OUTPUT = 'OUTPUT'
     INPUT = 'INPUT'
+    FIELDS = 'FIELDS'
+    PARALLEL = 'PARALLEL'
+    WORKERS = 'WORKERS'
+    INCREMENTAL = 'INCREMENTAL'
+    COMPRESSION = 'COMPRESSION'
+    LEVEL = 'LEVEL'
+
+    # Parallel modes
+    SINGLE = 0
+    MERGED = 1
+    SHARDED = 2
+
+    # Incremental modes
+    FULL = 0
+    DELTA = 1
+    PATCH = 2
 
     def initAlgorithm(self, config=None):
         self.addParameter(
@@ -19,43 +111,294 @@ class SaveAttributesAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.FIELDS,
+                self.tr('Fields to save (all if none are selected)'),
+                None,
+                self.INPUT,
+                allowMultiple=True,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.PARALLEL,
+                self.tr('Parallel export'),
+                options=[self.tr('No, read the layer with a single iterator'),
+                         self.tr('Yes, merge the parts into one ordered CSV'),
+                         self.tr('Yes, keep one CSV per part (<name>_partN.csv)')],
+                defaultValue=self.SINGLE
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.WORKERS,
+                self.tr('Parallel workers'),
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=max(min(os.cpu_count() or 1, 8), 1),
+                minValue=1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.INCREMENTAL,
+                self.tr('Incremental export'),
+                options=[self.tr('No, export every feature'),
+                         self.tr('Yes, write the changes since the last export '
+                                 'to <output>.delta.csv'),
+                         self.tr('Yes, patch the output file of the last export')],
+                defaultValue=self.FULL
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.COMPRESSION,
+                self.tr('Compression of the CSV file'),
+                options=[self.tr('By the extension of the output file '
+                                 '(.gz, .xz or .zst)'),
+                         self.tr('None'), 'gzip', 'xz',
+                         self.tr('zstd (requires the zstandard package)')],
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.LEVEL,
+                self.tr('Compression level (-1 for the default)'),
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=-1,
+                minValue=-1,
+                maxValue=22
+            )
+        )
+
         # We add a file output of type CSV.
         self.addParameter(
             QgsProcessingParameterFileDestination(
                 self.OUTPUT,
                 self.tr('Output File'),
-                'CSV files (*.csv)',
+                'CSV files (*.csv);;Arrow IPC files (*.arrow);;'
+                'Parquet files (*.parquet);;NumPy files (*.npz)',
             )
         )
 
     def processAlgorithm(self, parameters, context, feedback):
         source = self.parameterAsSource(parameters, self.INPUT, context)
-        csv = self.parameterAsFileOutput(parameters, self.OUTPUT, context)
+        fieldnames = self.parameterAsFields(parameters, self.FIELDS, context)
+        parallel = self.parameterAsEnum(parameters, self.PARALLEL, context)
+        workers = self.parameterAsInt(parameters, self.WORKERS, context)
+        incremental = self.parameterAsEnum(parameters, self.INCREMENTAL, context)
+        compressionIndex = self.parameterAsEnum(parameters, self.COMPRESSION, context)
+        level = self.parameterAsInt(parameters, self.LEVEL, context)
+        csvPath = self.parameterAsFileOutput(parameters, self.OUTPUT, context)
+
+        # Compression of the CSV file, by parameter or by extension
+        if compressionIndex == 0:
+            compression = compressionOf(csvPath)
+        elif compressionIndex == 1:
+            compression = None
+        else:
+            compression = COMPRESSIONS[compressionIndex - 2]
+            if compressionOf(csvPath) != compression:
+                csvPath += EXTENSIONS[compression]
+        if compression is not None and level > MAX_LEVELS[compression]:
+            raise RuntimeError(f"The 'Compression level' parameter must be at "
+                               f"most {MAX_LEVELS[compression]} for the "
+                               f"{compression} compression")
+        opener = partial(openText, compression=compression, level=level)
+
+        fields = source.fields()
+        if not fieldnames:
+            fieldnames = fields.names()
+        indices = [fields.lookupField(name) for name in fieldnames]
 
-        fieldnames = [field.name() for field in source.fields()]
+        # Only fetch the attributes that are saved
+        request = QgsFeatureRequest()
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes(indices)
 
-        # Compute the number of steps to display within the progress bar and
-        # get features from source
+        # Compute the number of steps to display within the progress bar
         total = 100.0 / source.featureCount() if source.featureCount() else 0
-        features = source.getFeatures()
+        done = [0]
+        lock = threading.Lock()
+
+        def progress(count):
+            with lock:
+                done[0] += count
+                feedback.setProgress(int(done[0] * total))
+
+        # Columnar formats, chosen by the extension of the output file
+        uncompressedPath = csvPath[:len(csvPath) - len(EXTENSIONS.get(compression, ''))]
+        fmt = FORMATS.get(os.path.splitext(uncompressedPath)[1].lower(), 'csv')
+        if fmt != 'csv':
+            if compression is not None:
+                raise RuntimeError("The compression is only available for "\
+                    "CSV files in the 'Output File' parameter")
+            if parallel != self.SINGLE or incremental != self.FULL:
+                raise RuntimeError("The parallel and incremental exports are "\
+                    "only available for CSV files in the 'Output File' parameter")
+            if fmt != 'npz' and pa is None:
+                csvPath = os.path.splitext(csvPath)[0] + '.npz'
+                fmt = 'npz'
+                feedback.pushInfo('pyarrow is not installed, the attributes '
+                                  f'are saved to {csvPath} instead')
+            features = source.getFeatures(request)
+            if fmt == 'npz':
+                writeNpz(csvPath, fields, fieldnames, indices, features,
+                         feedback, progress)
+            else:
+                writeArrow(csvPath, fmt, fields, fieldnames, indices,
+                           features, feedback, progress)
+            return {self.OUTPUT: csvPath}
+
+        if compression is not None and incremental != self.FULL:
+            raise RuntimeError("The incremental export can not be "\
+                "combined with a compressed output file")
+
+        if incremental != self.FULL:
+            if parallel != self.SINGLE:
+                raise RuntimeError("The incremental export can not be "\
+                    "combined with the parallel export")
+            return {self.OUTPUT: self.exportIncremental(
+                source, request, fieldnames, indices, csvPath, incremental,
+                feedback, progress)}
+
+        if parallel == self.SINGLE:
+            writeCsv(csvPath, fieldnames, indices, source.getFeatures(request),
+                     feedback, progress, opener)
+            return {self.OUTPUT: csvPath}
+
+        parts = self.exportParallel(parameters, context, feedback, source,
+                                    request, fieldnames, indices, workers,
+                                    csvPath, parallel, progress, opener)
+        if parallel == self.SHARDED:
+            feedback.pushInfo('Parts written: ' + ', '.join(parts))
+            return {self.OUTPUT: parts[0] if parts else csvPath}
+
+        # Append the parts in FID order to the merged file; concatenated
+        # gzip, xz and zstd streams are valid streams too
+        with open(csvPath, 'wb') as outputFile:
+            for part in parts:
+                with open(part, 'rb') as partFile:
+                    shutil.copyfileobj(partFile, outputFile, BUFFER_SIZE)
+                os.remove(part)
+        return {self.OUTPUT: csvPath}
+
+    def exportIncremental(self, source, request, fieldnames, indices,
+                          csvPath, incremental, feedback, progress):
+        """Exports only the features changed since the last export.
+
+        A manifest with the FID and content hash of every row is kept next
+        to the output file. The inserted, updated and deleted rows are found
+        by hashing every row and are either written to a delta CSV next to
+        the output file, which is left as it is, or patched into the output
+        file. Without a manifest of the current output file every feature
+        is exported to it. Returns the file written.
+        """
+        manifest = readManifest(csvPath, fieldnames)
+        if manifest is None or not os.path.exists(csvPath) or \
+                os.path.getsize(csvPath) != manifest['size']:
+            feedback.pushInfo('No previous export was found, every feature '
+                              'is exported')
+            fullExport(csvPath, fieldnames,
+                       attributeRows(source.getFeatures(request), indices,
+                                     feedback, progress))
+            return csvPath
+
+        rows = attributeRows(source.getFeatures(request), indices, feedback,
+                             progress)
+        changed, deleted, fids, hashes = diffRows(rows, manifest)
+
+        # An interrupted comparison would take the unread rows as deleted
+        if feedback.isCanceled():
+            return csvPath
+        inserted = sum(1 for line, digest, isNew in changed.values() if isNew)
+        feedback.pushInfo(f'{inserted} features inserted, '
+                          f'{len(changed) - inserted} updated and '
+                          f'{int(np.count_nonzero(deleted))} deleted')
+
+        if incremental == self.DELTA:
+            # The output file and its manifest are kept, so the delta holds
+            # the changes since the output file was last written
+            path = deltaPath(csvPath)
+            writeDelta(path, fieldnames, manifest, changed, deleted)
+            feedback.pushInfo(f'Changes written to {path}')
+            return path
+        patchCsv(csvPath, fieldnames, manifest, changed, deleted)
+        return csvPath
+
+    def exportParallel(self, parameters, context, feedback, source, request,
+                       fieldnames, indices, workers, csvPath, parallel,
+                       progress, opener):
+        """Exports contiguous FID ranges of the source in worker threads.
+
+        The ranges split the FIDs of the features of the source, so a
+        selection applied to the input is kept. Every worker opens its own
+        copy of the layer, and so its own provider connection, and writes
+        its range to a part file. The workers are threads: the provider
+        reads overlap, but the CSV formatting still runs under the GIL.
+        Only the first part has the header when the parts are to be
+        merged. Returns the part files in FID order.
+        """
+        layer = self.parameterAsVectorLayer(parameters, self.INPUT, context)
+        if layer is None or layer.providerType() == 'memory':
+            raise RuntimeError("The parallel export requires the 'Input "\
+                "layer' parameter to be a layer stored in a file or database")
 
-        with open(csv, 'w') as output_file:
-          # write header
-          line = ','.join(name for name in fieldnames) + '\n'
-          output_file.write(line)
-          for current, f in enumerate(features):
-              # Stop the algorithm if cancel button has been clicked
-              if feedback.isCanceled():
-                  break
+        # FIDs of the features of the source, without geometry or attributes
+        fidRequest = QgsFeatureRequest()
+        fidRequest.setFlags(QgsFeatureRequest.NoGeometry)
+        fidRequest.setNoAttributes()
+        fids = sorted(f.id() for f in source.getFeatures(fidRequest))
+        size = -(-len(fids) // workers) if fids else 1
+        ranges = [fids[i:i + size] for i in range(0, len(fids), size)] or [[]]
 
-              # Add a feature in the sink
-              line = ','.join(str(f[name]) for name in fieldnames) + '\n'
-              output_file.write(line)
+        # With a single integer primary key, whose values are the FIDs,
+        # every range is read by the provider with a subset string on the
+        # key. The FIDs are listed only for a selection or without such a key
+        definition = parameters.get(self.INPUT)
+        selected = isinstance(definition, QgsProcessingFeatureSourceDefinition) \
+            and definition.selectedFeaturesOnly
+        keys = layer.dataProvider().pkAttributeIndexes()
+        key = None
+        if len(keys) == 1 and layer.fields().at(keys[0]).type() in \
+                (QVariant.Int, QVariant.LongLong):
+            key = QgsExpression.quotedColumnRef(layer.fields().at(keys[0]).name())
+        base, extension = splitExtension(csvPath)
+        parts = [f'{base}_part{i + 1}{extension or ".csv"}'
+                 for i in range(len(ranges))]
+        feedback.pushInfo(f'Exporting {len(fids)} features in '
+                          f'{len(ranges)} parts')
 
-              # Update the progress bar
-              feedback.setProgress(int(current * total))
+        def exportRange(k):
+            partLayer = QgsVectorLayer(layer.source(), f'part{k}',
+                                       layer.providerType())
+            if not partLayer.isValid():
+                raise RuntimeError(f"The layer could not be opened for part {k + 1}")
+            partRequest = QgsFeatureRequest(request)
+            filtered = False
+            if key is not None and ranges[k]:
+                condition = f'{key} BETWEEN {ranges[k][0]} AND {ranges[k][-1]}'
+                if partLayer.subsetString():
+                    condition = f'({partLayer.subsetString()}) AND {condition}'
+                filtered = partLayer.setSubsetString(condition)
+            if selected or not filtered:
+                partRequest.setFilterFids(ranges[k])
+            header = fieldnames if parallel == self.SHARDED or k == 0 else None
+            writeCsv(parts[k], header, indices,
+                     partLayer.getFeatures(partRequest), feedback, progress,
+                     opener)
 
-        return {self.OUTPUT: csv}
+        with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+            for future in [pool.submit(exportRange, k) for k in range(len(ranges))]:
+                future.result()
+        return parts
 
     def name(self):
         return 'save_attributes'
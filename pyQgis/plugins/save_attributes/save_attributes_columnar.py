@@ -0,0 +1,124 @@
+import numpy as np
+from PyQt5.QtCore import QByteArray, QDate, QDateTime, QTime, QVariant
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+# Number of features of every record batch
+BATCH_ROWS = 65536
+
+# Columnar formats by file extension
+FORMATS = {'.arrow': 'arrow', '.feather': 'arrow', '.parquet': 'parquet',
+           '.npz': 'npz'}
+
+# Field types with a numeric NumPy column; the other types are saved as text
+NUMPY_TYPES = {QVariant.Int: np.int64, QVariant.UInt: np.int64,
+               QVariant.LongLong: np.int64, QVariant.ULongLong: np.uint64,
+               QVariant.Double: np.float64, QVariant.Bool: np.bool_}
+
+
+def arrowType(fieldType):
+    """Returns the Arrow type of a QGIS field type."""
+    return {QVariant.Int: pa.int32(),
+            QVariant.UInt: pa.uint32(),
+            QVariant.LongLong: pa.int64(),
+            QVariant.ULongLong: pa.uint64(),
+            QVariant.Double: pa.float64(),
+            QVariant.Bool: pa.bool_(),
+            QVariant.Date: pa.date32(),
+            QVariant.DateTime: pa.timestamp('ms'),
+            QVariant.Time: pa.time64('us'),
+            QVariant.ByteArray: pa.binary()}.get(fieldType, pa.string())
+
+
+def pythonValue(value):
+    """Converts an attribute value to a plain Python value, NULL to None."""
+    if isinstance(value, QVariant):
+        return None if value.isNull() else value.value()
+    if isinstance(value, QDate):
+        return value.toPyDate() if value.isValid() else None
+    if isinstance(value, QDateTime):
+        return value.toPyDateTime() if value.isValid() else None
+    if isinstance(value, QTime):
+        return value.toPyTime() if value.isValid() else None
+    if isinstance(value, QByteArray):
+        return bytes(value)
+    return value
+
+
+def featureColumns(features, indices, feedback, progress, batchRows):
+    """Yields the attributes of the features in batches of columns."""
+    columns = [[] for i in indices]
+    for current, f in enumerate(features):
+        if current % batchRows == 0 and current:
+            # Stop the algorithm if cancel button has been clicked
+            if feedback.isCanceled():
+                return
+            progress(batchRows)
+            yield columns
+            columns = [[] for i in indices]
+        attributes = f.attributes()
+        for column, i in zip(columns, indices):
+            column.append(pythonValue(attributes[i]))
+    if columns and columns[0]:
+        yield columns
+
+
+def writeArrow(path, fmt, fields, fieldnames, indices, features, feedback,
+               progress):
+    """Writes the attributes to an Arrow IPC or Parquet file by batches."""
+    types = [arrowType(fields.at(i).type()) for i in indices]
+    schema = pa.schema([pa.field(name, t) for name, t in zip(fieldnames, types)])
+    if fmt == 'parquet':
+        writer = pa.parquet.ParquetWriter(path, schema)
+    else:
+        writer = pa.ipc.new_file(path, schema)
+    with writer:
+        for columns in featureColumns(features, indices, feedback, progress,
+                                      BATCH_ROWS):
+            arrays = [pa.array(column if t != pa.string() else
+                               [v if v is None else str(v) for v in column],
+                               type=t)
+                      for column, t in zip(columns, types)]
+            batch = pa.record_batch(arrays, schema=schema)
+            if fmt == 'parquet':
+                writer.write_table(pa.Table.from_batches([batch]))
+            else:
+                writer.write_batch(batch)
+
+
+def writeNpz(path, fields, fieldnames, indices, features, feedback, progress):
+    """Writes the attributes to a compressed NumPy .npz file, a column each.
+
+    Numeric columns keep their type unless they hold NULL values, which are
+    saved as NaN in a float column; dates and times are saved as datetime64
+    and the other types as text, with NULL as an empty string.
+    """
+    columns = [[] for i in indices]
+    for batch in featureColumns(features, indices, feedback, progress,
+                                BATCH_ROWS):
+        for column, values in zip(columns, batch):
+            column.extend(values)
+    if feedback.isCanceled():
+        return
+
+    arrays = {}
+    for name, i, column in zip(fieldnames, indices, columns):
+        fieldType = fields.at(i).type()
+        if fieldType in NUMPY_TYPES:
+            if any(v is None for v in column):
+                arrays[name] = np.array([np.nan if v is None else v
+                                         for v in column], dtype=np.float64)
+            else:
+                arrays[name] = np.array(column, dtype=NUMPY_TYPES[fieldType])
+        elif fieldType in (QVariant.Date, QVariant.DateTime):
+            unit = 'D' if fieldType == QVariant.Date else 'ms'
+            arrays[name] = np.array(['NaT' if v is None else v.isoformat()
+                                     for v in column], dtype=f'datetime64[{unit}]')
+        else:
+            arrays[name] = np.array(['' if v is None else str(v)
+                                     for v in column], dtype=str)
+    np.savez_compressed(path, **arrays)
@@ -0,0 +1,124 @@
+import io
+import lzma
+import queue
+import threading
+import zlib
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Size of the buffer of the output files
+BUFFER_SIZE = 8 * 1024 * 1024
+
+# Number of buffers waiting to be compressed by the writer thread
+QUEUE_SIZE = 8
+
+COMPRESSIONS = ['gzip', 'xz', 'zstd']
+EXTENSIONS = {'gzip': '.gz', 'xz': '.xz', 'zstd': '.zst'}
+DEFAULT_LEVELS = {'gzip': 6, 'xz': 6, 'zstd': 3}
+MAX_LEVELS = {'gzip': 9, 'xz': 9, 'zstd': 22}
+
+
+def compressionOf(path):
+    """Returns the compression matching the extension of a path, or None."""
+    for compression, extension in EXTENSIONS.items():
+        if path.lower().endswith(extension):
+            return compression
+    return None
+
+
+def splitExtension(path):
+    """Splits a path into its root and its extension, with the compression.
+
+    For example 'out.csv.gz' gives ('out', '.csv.gz').
+    """
+    compression = compressionOf(path)
+    suffix = EXTENSIONS[compression] if compression else ''
+    root = path[:len(path) - len(suffix)]
+    dot = root.rfind('.')
+    if dot > max(root.rfind('/'), root.rfind('\\')):
+        return root[:dot], root[dot:] + suffix
+    return root, suffix
+
+
+def compressor(compression, level):
+    """Returns a streaming compressor with compress and flush methods."""
+    if level < 0:
+        level = DEFAULT_LEVELS[compression]
+    if level > MAX_LEVELS[compression]:
+        raise RuntimeError(f"The 'Compression level' parameter must be at most "
+                           f"{MAX_LEVELS[compression]} for the {compression} "
+                           f"compression")
+    if compression == 'gzip':
+        # Window bits of 16 + 15 write the gzip container
+        return zlib.compressobj(level, zlib.DEFLATED, 31)
+    if compression == 'xz':
+        return lzma.LZMACompressor(preset=level)
+    if zstandard is None:
+        raise RuntimeError("The zstd compression requires the zstandard "
+                           "package, which is not installed")
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+
+class CompressedFile(io.RawIOBase):
+    """Binary file that compresses what is written in a background thread.
+
+    The buffers written are queued and compressed to disk by a writer
+    thread, so the compression overlaps with producing the data.
+    """
+
+    def __init__(self, path, compression, level=-1):
+        super().__init__()
+        self.compressor = compressor(compression, level)
+        self.file = open(path, 'wb')
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(bytes(data))
+        return len(data)
+
+    def run(self):
+        sentinelSeen = False
+        try:
+            while True:
+                data = self.queue.get()
+                if data is None:
+                    sentinelSeen = True
+                    break
+                self.file.write(self.compressor.compress(data))
+            self.file.write(self.compressor.flush())
+        except Exception as e:
+            self.error = e
+            # Keep consuming the queue up to the end marker so that the
+            # writer does not block; after the marker nothing more comes
+            while not sentinelSeen:
+                sentinelSeen = self.queue.get() is None
+        finally:
+            self.file.close()
+
+    def close(self):
+        if not self.closed:
+            self.queue.put(None)
+            self.thread.join()
+            super().close()
+            if self.error is not None:
+                raise self.error
+
+
+def openText(path, compression=None, level=-1):
+    """Opens a text file for writing CSV rows, compressed if requested."""
+    if compression is None:
+        return open(path, 'w', newline='', encoding='utf-8',
+                    buffering=BUFFER_SIZE)
+    return io.TextIOWrapper(
+        io.BufferedWriter(CompressedFile(path, compression, level), BUFFER_SIZE),
+        encoding='utf-8', newline='')
@@ -0,0 +1,200 @@
+import csv
+import hashlib
+import io
+import os
+from array import array
+
+import numpy as np
+
+# Size of the buffer of the output files
+BUFFER_SIZE = 8 * 1024 * 1024
+
+# Bytes of the content hash of every row
+DIGEST_SIZE = 16
+
+
+def manifestPath(csvPath):
+    """Returns the path of the manifest kept next to an output file."""
+    return csvPath + '.manifest.npz'
+
+
+def deltaPath(csvPath):
+    """Returns the path of the delta CSV kept next to an output file."""
+    root, extension = os.path.splitext(csvPath)
+    return f'{root}.delta{extension or ".csv"}'
+
+
+def readManifest(csvPath, fieldnames):
+    """Reads the manifest of an output file.
+
+    The manifest holds the FID, content hash and byte offset of every row
+    of the output, in the order of the file. Returns None if there is no
+    manifest or it was written for other fields.
+    """
+    path = manifestPath(csvPath)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as manifest:
+        if manifest['fields'].tolist() != list(fieldnames):
+            return None
+        return {key: manifest[key] for key in ('fid', 'hash', 'offset', 'size')}
+
+
+def writeManifest(csvPath, fieldnames, fids, hashes, offsets, size):
+    """Writes the manifest of an output file, see readManifest.
+
+    The hashes are given as the concatenation of their bytes.
+    """
+    with open(manifestPath(csvPath), 'wb') as f:
+        np.savez(f, fields=np.array(fieldnames, dtype=str),
+                 fid=np.asarray(fids, dtype=np.int64),
+                 hash=np.frombuffer(bytes(hashes), dtype=np.uint8)
+                        .reshape(-1, DIGEST_SIZE),
+                 offset=np.asarray(offsets, dtype=np.int64),
+                 size=np.int64(size))
+
+
+class RowEncoder:
+    """Encodes rows as CSV lines, as csv.writer writes them, and hashes them."""
+
+    def __init__(self):
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+
+    def encode(self, row):
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.writer.writerow(row)
+        line = self.buffer.getvalue().encode('utf-8')
+        return line, hashlib.blake2b(line, digest_size=DIGEST_SIZE).digest()
+
+
+def fullExport(csvPath, fieldnames, rows):
+    """Writes every row to the output file and its manifest.
+
+    The rows are (fid, values) pairs.
+    """
+    encoder = RowEncoder()
+    fids = array('q')
+    hashes = bytearray()
+    offsets = array('q')
+    with open(csvPath, 'wb', buffering=BUFFER_SIZE) as outputFile:
+        position = outputFile.write(encoder.encode(fieldnames)[0])
+        for fid, values in rows:
+            line, digest = encoder.encode(values)
+            fids.append(fid)
+            hashes += digest
+            offsets.append(position)
+            position += outputFile.write(line)
+    writeManifest(csvPath, fieldnames, fids, hashes, offsets, position)
+    return len(fids)
+
+
+def diffRows(rows, manifest):
+    """Compares the rows of the layer with the manifest of the last export.
+
+    Only the lines of the inserted and updated rows are kept. Returns a
+    dict of those rows by FID, with their line, hash and whether they are
+    new, the mask of the manifest rows that were deleted and the FIDs and
+    concatenated hashes of every row, in the order of the layer.
+    """
+    encoder = RowEncoder()
+    order = np.argsort(manifest['fid'], kind='stable')
+    sortedFids = manifest['fid'][order]
+    seen = np.zeros(sortedFids.size, dtype=bool)
+    changed = {}
+    fids = array('q')
+    hashes = bytearray()
+    for fid, values in rows:
+        line, digest = encoder.encode(values)
+        fids.append(fid)
+        hashes += digest
+        pos = np.searchsorted(sortedFids, fid)
+        if pos < sortedFids.size and sortedFids[pos] == fid:
+            seen[pos] = True
+            if manifest['hash'][order[pos]].tobytes() != digest:
+                changed[fid] = (line, digest, False)
+        else:
+            changed[fid] = (line, digest, True)
+    deleted = np.zeros(seen.size, dtype=bool)
+    deleted[order] = ~seen
+    return changed, deleted, fids, hashes
+
+
+def writeDelta(deltaPath, fieldnames, manifest, changed, deleted):
+    """Writes the inserted, updated and deleted rows to a delta CSV file."""
+    deletedFids = manifest['fid'][deleted]
+    with open(deltaPath, 'wb', buffering=BUFFER_SIZE) as outputFile:
+        encoder = RowEncoder()
+        outputFile.write(encoder.encode(['change', 'fid'] + list(fieldnames))[0])
+        for fid in sorted(changed):
+            line, digest, isNew = changed[fid]
+            prefix = encoder.encode(['insert' if isNew else 'update', fid])[0]
+            outputFile.write(prefix.rstrip(b'\r\n') + b',' + line)
+        for fid in np.sort(deletedFids):
+            outputFile.write(encoder.encode(['delete', int(fid)])[0])
+    return len(deletedFids)
+
+
+def patchCsv(csvPath, fieldnames, manifest, changed, deleted):
+    """Applies the changes to the output file of the last export.
+
+    The unchanged rows are copied as byte ranges from the old file, the
+    updated rows replace their old line, the deleted rows are dropped and
+    the inserted rows are appended. The manifest is updated.
+    """
+    oldFids = manifest['fid']
+    oldOffsets = manifest['offset']
+    ends = np.append(oldOffsets[1:], manifest['size'])
+    updated = np.isin(oldFids, [fid for fid in changed if not changed[fid][2]])
+    touched = np.nonzero(updated | deleted)[0]
+
+    tmpPath = csvPath + '.tmp'
+    fids = array('q')
+    hashes = bytearray()
+    offsets = array('q')
+    with open(csvPath, 'rb') as oldFile, \
+         open(tmpPath, 'wb', buffering=BUFFER_SIZE) as outputFile:
+
+        def copyRows(start, stop):
+            # Copies the unchanged rows [start, stop) of the old file
+            if start >= stop:
+                return
+            begin = oldOffsets[start]
+            oldFile.seek(begin)
+            remaining = int(ends[stop - 1] - begin)
+            shift = outputFile.tell() - begin
+            while remaining:
+                chunk = oldFile.read(min(remaining, BUFFER_SIZE))
+                outputFile.write(chunk)
+                remaining -= len(chunk)
+            fids.extend(oldFids[start:stop].tolist())
+            hashes.extend(manifest['hash'][start:stop].tobytes())
+            offsets.extend((oldOffsets[start:stop] + shift).tolist())
+
+        # Header
+        oldFile.seek(0)
+        outputFile.write(oldFile.read(int(oldOffsets[0]) if oldOffsets.size
+                                      else int(manifest['size'])))
+        start = 0
+        for i in touched.tolist():
+            copyRows(start, i)
+            if updated[i]:
+                line, digest, isNew = changed[int(oldFids[i])]
+                fids.append(int(oldFids[i]))
+                hashes += digest
+                offsets.append(outputFile.tell())
+                outputFile.write(line)
+            start = i + 1
+        copyRows(start, oldFids.size)
+
+        # Inserted rows
+        for fid in sorted(fid for fid in changed if changed[fid][2]):
+            line, digest, isNew = changed[fid]
+            fids.append(fid)
+            hashes += digest
+            offsets.append(outputFile.tell())
+            outputFile.write(line)
+        size = outputFile.tell()
+    os.replace(tmpPath, csvPath)
+    writeManifest(csvPath, fieldnames, fids, hashes, offsets, size)
@@ -16,7 +16,8 @@
 # ***************************************************************************
 #     Instrucciones de uso como complemento para QGIS
 #     -----------------------------------------------
-#     1. Ubicar este archivo en la dirección adecuada según el OS:
+#     1. Ubicar este archivo y RasterToBasinEngine.py (código de los
+#        procesos paralelos) en la dirección adecuada según el OS:
 #         1.1. Windows:
 #             C:\Users\<usuario>\AppData\Roaming\QGIS\QGIS3\profiles\...
 #             ...<perfil>\processing\scripts\RasterToBasin.py
@@ -34,25 +35,365 @@
 #         4.1. Input layer: Capa raster que corresponde al DEM.
 #         4.2. Band number: Número de la banda que representa la elevación.
 #         4.3. Fill value: Número para rellenar la matriz de cuenca.
-#         4.4. Output file: Dirección del archivo TXT de salida.
+#         4.4. Window size: Número de filas del raster que se leen a la vez.
+#              Define el consumo máximo de memoria del algoritmo.
+#         4.5. Parallel workers: Número de procesos que exportan la matriz
+#              en paralelo. Con 0 se exporta en un solo proceso. Solo
+#              disponible para rasters leídos con GDAL.
+#         4.6. Only cells with data: Escribe solo las celdas con datos. Junto
+#              al archivo de salida se crea <nombre>_cells.csv, que relaciona
+#              cada celda (desde 1) con su fila y columna del raster (desde 0).
+#         4.7. Maximum lat/lon error: Error máximo (en grados) de la latitud
+#              y longitud aproximadas. Con un valor mayor que 0 solo se
+#              transforma exactamente una malla gruesa de celdas y el resto
+#              se interpola, refinando la malla donde se supera el error.
+#              Por ejemplo, 1e-7 para la precisión de 6 decimales de salida.
+#         4.8. Resume: Continúa una exportación interrumpida desde el último
+#              punto de control (<salida>.checkpoint) en lugar de empezar
+#              desde la fila 0. Los parámetros deben ser los mismos.
+#         4.9. Variables from other rasters: Tabla con las columnas de la
+#              matriz (p. ej. S0, HU, LAI) que se llenan con los valores de
+#              otros rasters alineados con el DEM, indicando la ruta y la
+#              banda de cada uno. Las celdas sin datos se llenan con el
+#              Fill value.
+#         4.10. Drainage topology: Calcula las columnas destino y tramo. Se
+#               rellenan las depresiones del DEM (priority-flood) y cada
+#               celda drena a su vecina D8 de mayor pendiente; destino es el
+#               número de la celda aguas abajo (0 en las salidas de la
+#               cuenca) y tramo el número del tramo de cauce de la celda.
+#               Requiere tener el DEM completo en memoria como arreglo.
+#         4.11. Channel threshold: Área drenada mínima (en celdas) para que
+#               una celda haga parte de un cauce.
+#         4.12. Output file: Dirección del archivo TXT de salida.
 # ***************************************************************************
 
 __author__ = 'Gotta Ingeniería'
 __date__ = 'November 2022'
 __copyright__ = '(C) 2022, Gotta Ingeniería'
 
+import heapq
+import json
+import os
+import shutil
+import sys
+import time
+import multiprocessing
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait
+from contextlib import ExitStack
+
+import numpy as np
 from PyQt5.QtCore import QCoreApplication
-from qgis.core import (QgsProcessing,
+from qgis.core import (Qgis,
+                       QgsProcessing,
                        QgsProcessingAlgorithm,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterBand,
                        QgsProcessingParameterNumber,
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterMatrix,
                        QgsProcessingParameterFileDestination,
-                       QgsCoordinateReferenceSystem,
-                       QgsCoordinateTransform,
-                       QgsProject,
-                       QgsPoint,
-                       QgsGeometry)
+                       QgsProcessingOutputFile,
+                       QgsRasterLayer,
+                       QgsRectangle)
+
+# The code run by the worker processes is in RasterToBasinEngine.py, next to
+# this script, so that they can import it without QGIS
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPT_DIR not in sys.path:
+    sys.path.insert(0, SCRIPT_DIR)
+from RasterToBasinEngine import (BUFFER_SIZE, TOPOLOGY_COLUMNS,
+                                 StripExporter, cellMapWriter, exportBand,
+                                 nodataMask, sigaHeader, sigaVariables,
+                                 writeCellMap)
+
+
+# Seconds between two checkpoints of the serial export
+CHECKPOINT_SECONDS = 30
+
+# Columns of the SIGA variable matrix computed from the DEM itself
+DEM_COLUMNS = ('X', 'Y', 'Z', 'lat', 'lon')
+
+# Row and column offsets of the eight D8 neighbours
+D8_OFFSETS = ((-1, -1), (-1, 0), (-1, 1),
+              (0, -1), (0, 1),
+              (1, -1), (1, 0), (1, 1))
+
+# NumPy data types matching the QGIS raster data types
+RASTER_DTYPES = {Qgis.Byte: np.uint8,
+                 Qgis.UInt16: np.uint16,
+                 Qgis.Int16: np.int16,
+                 Qgis.UInt32: np.uint32,
+                 Qgis.Int32: np.int32,
+                 Qgis.Float32: np.float32,
+                 Qgis.Float64: np.float64}
+if hasattr(Qgis, 'Int8'):
+    RASTER_DTYPES[Qgis.Int8] = np.int8
+
+
+def blockToArray(block):
+    """Returns a NumPy view over the data of a raster block and its mask.
+
+    The view shares the memory of the block, so the block must be kept
+    alive while the view is in use. The mask is True on nodata cells.
+    """
+    dtype = RASTER_DTYPES.get(block.dataType())
+    if dtype is None:
+        raise RuntimeError("The data type of the 'Input layer' parameter "
+                           "is not supported")
+    values = np.frombuffer(block.data(), dtype=dtype)
+    values = values.reshape(block.height(), block.width())
+
+    nodata = block.noDataValue() if block.hasNoDataValue() else None
+    return values, nodataMask(values, nodata)
+
+
+class ProviderStripReader:
+    """Reads strips of rows of a raster band through its QGIS provider.
+
+    The arrays returned by read() are views over the last block read, so
+    they are only valid until the next call.
+    """
+
+    def __init__(self, layer, band):
+        # Keep the layer alive, it owns the provider
+        self.layer = layer
+        self.provider = layer.dataProvider()
+        self.band = band
+        self.extent = layer.extent()
+        self.cols = layer.width()
+        self.cszy = layer.rasterUnitsPerPixelY()
+        self.block = None
+
+    def read(self, row0, nrows):
+        """Returns the values and nodata mask of nrows rows from row0."""
+        self.block = None
+        yul = self.extent.yMaximum()
+        stripExtent = QgsRectangle(self.extent.xMinimum(),
+                                   yul - (row0 + nrows)*self.cszy,
+                                   self.extent.xMaximum(),
+                                   yul - row0*self.cszy)
+        self.block = self.provider.block(self.band, stripExtent,
+                                         self.cols, nrows)
+        return blockToArray(self.block)
+
+
+def _toArray(values, typecode):
+    """Returns a copy of a NumPy array as a compact array.array.
+
+    Indexing an array.array from Python is much faster than indexing a
+    NumPy array, and it takes far less memory than a list.
+    """
+    result = array(typecode)
+    result.frombytes(np.ascontiguousarray(values).tobytes())
+    return result
+
+
+def drainageTopology(z, valid, channelCells, feedback=None):
+    """Computes the D8 drainage network of a DEM.
+
+    The depressions are filled with the priority-flood algorithm (Barnes et
+    al., 2014), seeded with the cells at the border of the valid area and
+    with a plain queue for the cells inside depressions and flats, so the
+    cost is O(n log n) in the worst case and close to O(n) on real DEMs.
+    Every cell then drains to its steepest downslope neighbour on the
+    filled DEM, or, on flats, to the neighbour the flood reached it from.
+    Cells with a drainage area of at least channelCells cells form the
+    channels, which are split into reaches at every confluence.
+
+    Returns two arrays with the shape of z: the flat index of the
+    downstream cell of every cell (-1 at the outlets and on invalid cells)
+    and the reach number of every channel cell (0 elsewhere). Returns None
+    if the feedback is cancelled.
+    """
+    rows, cols = z.shape
+    width = cols + 2
+    size = (rows + 2) * width
+
+    # Pad the grid with a border of invalid cells, so that the neighbours
+    # of any valid cell are always inside the grid
+    zPad = np.pad(np.where(valid, z, 0).astype(np.float64), 1)
+    validPad = np.pad(valid, 1)
+    index = np.arange(size).reshape(rows + 2, width)[1:-1, 1:-1]
+    offsets = tuple(dr*width + dc for dr, dc in D8_OFFSETS)
+
+    # Seed the flood with the valid cells that touch an invalid cell
+    surrounded = np.ones((rows, cols), dtype=bool)
+    for dr, dc in D8_OFFSETS:
+        surrounded &= validPad[1 + dr:rows + 1 + dr, 1 + dc:cols + 1 + dc]
+    seeds = index[valid & ~surrounded]
+
+    filled = _toArray(zPad, 'd')
+    closed = bytearray((~validPad).tobytes())
+    parent = array('q', [-1]) * size
+    order = array('q')
+    heap = [(filled[c], c) for c in seeds.tolist()]
+    heapq.heapify(heap)
+    for c in seeds.tolist():
+        closed[c] = 1
+    pit = deque()
+
+    heappop = heapq.heappop
+    heappush = heapq.heappush
+    while heap or pit:
+        if pit:
+            c = pit.popleft()
+            zc = filled[c]
+        else:
+            zc, c = heappop(heap)
+        order.append(c)
+        for offset in offsets:
+            n = c + offset
+            if closed[n]:
+                continue
+            closed[n] = 1
+            parent[n] = c
+            if filled[n] <= zc:
+                # Raise the cell to the spill level of the depression
+                filled[n] = zc
+                pit.append(n)
+            else:
+                heappush(heap, (filled[n], n))
+        if not len(order) & 0xFFFFF and feedback is not None and \
+                feedback.isCanceled():
+            return None
+
+    # Drain every cell to its steepest downslope neighbour. The flood
+    # processes the cells by increasing filled elevation, so both this
+    # neighbour and the flood parent come earlier in the order and the
+    # network has no cycles.
+    filledPad = np.frombuffer(filled, dtype=np.float64).reshape(rows + 2,
+                                                                width)
+    center = filledPad[1:-1, 1:-1]
+    dest = np.frombuffer(parent, dtype=np.int64).reshape(rows + 2,
+                                                         width)[1:-1, 1:-1]
+    dest = dest.copy()
+    steepest = np.zeros((rows, cols))
+    for (dr, dc), offset in zip(D8_OFFSETS, offsets):
+        neighbour = filledPad[1 + dr:rows + 1 + dr, 1 + dc:cols + 1 + dc]
+        slope = (center - neighbour) / (np.sqrt(2) if dr and dc else 1)
+        better = validPad[1 + dr:rows + 1 + dr, 1 + dc:cols + 1 + dc] & \
+            (slope > steepest)
+        steepest[better] = slope[better]
+        dest[better] = index[better] + offset
+    destPad = np.full(size, -1, dtype=np.int64)
+    destPad[index[valid]] = dest[valid]
+    del filled, filledPad, center, parent, steepest
+
+    # Accumulate the drainage area from upstream to downstream
+    destArray = _toArray(destPad, 'q')
+    area = array('q', [0]) * size
+    for c in reversed(order):
+        area[c] += 1
+        d = destArray[c]
+        if d >= 0:
+            area[d] += area[c]
+
+    # Number the reaches from downstream to upstream. A channel cell
+    # continues the reach of its downstream cell unless that cell is a
+    # confluence of several channels.
+    orderPad = np.frombuffer(order, dtype=np.int64)
+    channel = np.frombuffer(area, dtype=np.int64) >= channelCells
+    downstream = destPad[channel]
+    inflows = _toArray(np.bincount(downstream[downstream >= 0],
+                                   minlength=size).astype(np.int64), 'q')
+    reach = array('q', [0]) * size
+    nextReach = 1
+    for c in orderPad[channel[orderPad]].tolist():
+        d = destArray[c]
+        if d < 0 or inflows[d] > 1:
+            reach[c] = nextReach
+            nextReach += 1
+        else:
+            reach[c] = reach[d]
+
+    # Go back from padded to flat indices of the raster
+    dest = destPad[index]
+    dest = np.where(dest >= 0, (dest // width - 1)*cols + dest % width - 1,
+                    -1)
+    reach = np.frombuffer(reach, dtype=np.int64)[index]
+    return dest, reach
+
+
+def readCheckpoint(path, job, kind):
+    """Returns the checkpoint saved for an export of job, or None.
+
+    A checkpoint saved for an export with other settings, or by the other
+    kind of export ('serial' or 'parallel'), is ignored.
+    """
+    try:
+        with open(path) as checkpointFile:
+            checkpoint = json.load(checkpointFile)
+    except (OSError, ValueError):
+        return None
+    if checkpoint.get('kind') != kind or \
+            checkpoint.get('job') != json.loads(json.dumps(job)):
+        return None
+    return checkpoint
+
+
+def writeCheckpoint(path, checkpoint):
+    """Saves a checkpoint, replacing the previous one in a single step."""
+    with open(path + '.tmp', 'w') as checkpointFile:
+        json.dump(checkpoint, checkpointFile)
+    os.replace(path + '.tmp', path)
+
+
+def openForResume(path, offset):
+    """Opens an output file to write from offset, or from scratch if None."""
+    if offset is None:
+        return open(path, 'w', buffering=BUFFER_SIZE)
+    outputFile = open(path, 'r+', buffering=BUFFER_SIZE)
+    outputFile.seek(offset)
+    outputFile.truncate()
+    return outputFile
+
+
+def pythonExecutable():
+    """Returns the Python interpreter to spawn the worker processes with.
+
+    Inside QGIS sys.executable is the QGIS binary, not a Python interpreter,
+    so the interpreter of the QGIS installation is looked for. Returns None
+    if it is not found.
+    """
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        return sys.executable
+    if sys.platform == 'win32':
+        names = ['pythonw.exe', 'python.exe']
+        folders = [sys.exec_prefix]
+    else:
+        names = [f'python{sys.version_info[0]}.{sys.version_info[1]}',
+                 f'python{sys.version_info[0]}']
+        # On macOS the interpreter is in the bin folder of the app bundle
+        folders = [os.path.join(sys.exec_prefix, 'bin'),
+                   os.path.join(os.path.dirname(sys.executable), 'bin')]
+    for folder in folders:
+        for name in names:
+            python = os.path.join(folder, name)
+            if os.path.isfile(python):
+                return python
+    return None
+
+
+def processPool(workers):
+    """Returns a process pool and a manager for the parallel export.
+
+    The folder of the script is added to the import path of the spawned
+    processes, which only import the QGIS-free RasterToBasinEngine.
+    """
+    python = pythonExecutable()
+    if python is None:
+        raise RuntimeError("No Python interpreter was found for the "
+                           "parallel export, set the 'Parallel workers' "
+                           "parameter to 0")
+    pythonPath = os.environ.get('PYTHONPATH', '').split(os.pathsep)
+    if SCRIPT_DIR not in pythonPath:
+        os.environ['PYTHONPATH'] = os.pathsep.join([SCRIPT_DIR] + pythonPath)
+    ctx = multiprocessing.get_context('spawn')
+    ctx.set_executable(python)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=ctx), \
+           ctx.Manager()
 
 
 class RasterToBasinAlgorithm(QgsProcessingAlgorithm):
@@ -61,6 +402,15 @@ class RasterToBasinAlgorithm(QgsProcessingAlgorithm):
     OUTPUT = 'OUTPUT'
     BAND = 'BAND'
     FILLVALUE = 'FILLVALUE'
+    WINDOWSIZE = 'WINDOWSIZE'
+    WORKERS = 'WORKERS'
+    COMPACT = 'COMPACT'
+    MAXERROR = 'MAXERROR'
+    RESUME = 'RESUME'
+    EXTRAVARS = 'EXTRAVARS'
+    TOPOLOGY = 'TOPOLOGY'
+    CHANNELCELLS = 'CHANNELCELLS'
+    CELLMAP = 'CELLMAP'
 
     def initAlgorithm(self, config=None):
         self.addParameter(
@@ -93,6 +443,87 @@ class RasterToBasinAlgorithm(QgsProcessingAlgorithm):
         
         self.addParameter(fillValueParam)
 
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.WINDOWSIZE,
+                self.tr('Window size (rows read at once)'),
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=256,
+                minValue=1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.WORKERS,
+                self.tr('Parallel workers (0 to use a single process)'),
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=0,
+                minValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.COMPACT,
+                self.tr('Only cells with data (writes a cell index map)'),
+                defaultValue=False
+            )
+        )
+
+        maxErrorParam = QgsProcessingParameterNumber(
+                            self.MAXERROR,
+                            self.tr('Maximum lat/lon error of the approximate '
+                                    'transform (0 for exact)'),
+                            type=QgsProcessingParameterNumber.Double,
+                            defaultValue=0,
+                            minValue=0
+        )
+        
+        maxErrorParam.setMetadata(
+            {'widget_wrapper':{'decimals':9}
+            }
+        )
+        
+        self.addParameter(maxErrorParam)
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.RESUME,
+                self.tr('Resume from the last checkpoint'),
+                defaultValue=False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterMatrix(
+                self.EXTRAVARS,
+                self.tr('Variables from other rasters'),
+                headers=[self.tr('Column'),
+                         self.tr('Raster'),
+                         self.tr('Band')],
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.TOPOLOGY,
+                self.tr('Compute the drainage topology (destino and tramo)'),
+                defaultValue=False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.CHANNELCELLS,
+                self.tr('Channel threshold (drainage area in cells)'),
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=100,
+                minValue=1
+            )
+        )
+
         # We add a file output of type TXT.
         self.addParameter(
             QgsProcessingParameterFileDestination(
@@ -102,179 +533,404 @@ class RasterToBasinAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addOutput(
+            QgsProcessingOutputFile(
+                self.CELLMAP,
+                self.tr('Cell index map')
+            )
+        )
+
     def processAlgorithm(self, parameters, context, feedback):
         layer = self.parameterAsRasterLayer(parameters, self.INPUT, context)
         band = self.parameterAsInt(parameters, self.BAND, context)
         fillValue = self.parameterAsDouble(parameters, self.FILLVALUE, context)
+        window = self.parameterAsInt(parameters, self.WINDOWSIZE, context)
+        workers = self.parameterAsInt(parameters, self.WORKERS, context)
+        compact = self.parameterAsBool(parameters, self.COMPACT, context)
+        maxError = self.parameterAsDouble(parameters, self.MAXERROR, context)
+        resume = self.parameterAsBool(parameters, self.RESUME, context)
+        extraVars = self.parameterAsMatrix(parameters, self.EXTRAVARS, context)
+        topology = self.parameterAsBool(parameters, self.TOPOLOGY, context)
+        channelCells = self.parameterAsInt(parameters, self.CHANNELCELLS,
+                                           context)
         txt = self.parameterAsFileOutput(parameters, self.OUTPUT, context)
         
         if fillValue%1 == 0: fillValue = int(fillValue)
 
-        provider = layer.dataProvider()
         extent = layer.extent()
         rows = layer.height()
         cols = layer.width()
-        ncls = rows * cols
         cszx = layer.rasterUnitsPerPixelX()
         cszy = layer.rasterUnitsPerPixelY()
         csz = (cszx+cszy)/2
-        acl = csz ** 2
         yul = extent.yMaximum()
         xul = extent.xMinimum()
 
-        srcCrs = layer.crs()
-        dstCrs = QgsCoordinateReferenceSystem("EPSG:4326")
-        tr = QgsCoordinateTransform(srcCrs, dstCrs, QgsProject.instance())
-
-        block = provider.block(band, extent, cols, rows)
-
-        vars = {'tipo':0,
-                'destino':1,
-                'tramo':fillValue,
-                'llanura':fillValue,
-                'embalse':0,
-                'X':fillValue,
-                'Y':fillValue,
-                'Z':fillValue,
-                'lat':fillValue,
-                'lon':fillValue,
-                'L':fillValue,
-                'S':fillValue,
-                'D':fillValue,
-                'alfa1':fillValue,
-                'beta1':fillValue,
-                'S0':fillValue,
-                'S1':fillValue,
-                'S2':fillValue,
-                'S3':fillValue,
-                'S4':fillValue,
-                'S5':fillValue,
-                'H5b':fillValue,
-                'W5b':fillValue,
-                'Q5b':fillValue,
-                'HU':fillValue,
-                'LAI':fillValue,
-                'arcS2S':fillValue,
-                'limS2S':fillValue,
-                'areS2S':fillValue,
-                'arcS2D':fillValue,
-                'limS2D':fillValue,
-                'areS2D':fillValue,
-                'arcS5S':fillValue,
-                'limS5S':fillValue,
-                'areS5S':fillValue,
-                'arcS5D':fillValue,
-                'limS5D':fillValue,
-                'areS5D':fillValue,
-                'alfa2':fillValue,
-                'beta2':fillValue,
-                'alfa3':fillValue,
-                'beta3':fillValue,
-                'S0EC':fillValue,
-                'S1ECp':fillValue,
-                'S1ECs':fillValue,
-                'S2EC':fillValue,
-                'S3EC':fillValue,
-                'S4EC':fillValue,
-                'S0NO':fillValue,
-                'S1NOp':fillValue,
-                'S1NOs':fillValue,
-                'S2NO':fillValue,
-                'S3NO':fillValue,
-                'S4NO':fillValue,
-                'S0NH4':fillValue,
-                'S1NH4p':fillValue,
-                'S1NH4s':fillValue,
-                'S2NH4':fillValue,
-                'S3NH4':fillValue,
-                'S4NH4':fillValue,
-                'S0NO3':fillValue,
-                'S1NO3p':fillValue,
-                'S1NO3s':fillValue,
-                'S2NO3':fillValue,
-                'S3NO3':fillValue,
-                'S4NO3':fillValue,
-                'S0PO':fillValue,
-                'S1POp':fillValue,
-                'S1POs':fillValue,
-                'S2PO':fillValue,
-                'S3PO':fillValue,
-                'S4PO':fillValue,
-                'S0PI':fillValue,
-                'S1PIp':fillValue,
-                'S1PIs':fillValue,
-                'S2PI':fillValue,
-                'S3PI':fillValue,
-                'S4PI':fillValue,
-                'S0PO_fb':fillValue,
-                'S1POp_fb':fillValue,
-                'S1POs_fb':fillValue,
-                'S2PO_fb':fillValue,
-                'S3PO_fb':fillValue,
-                'S0PI_fb':fillValue,
-                'S1PIp_fb':fillValue,
-                'S1PIs_fb':fillValue,
-                'S2PI_fb':fillValue,
-                'S3PI_fb':fillValue,
-                'OD':fillValue,
-                'CDBO':fillValue,
-                'CE':fillValue,
-                'EC':fillValue,
-                'NO3':fillValue,
-                'NH4':fillValue,
-                'NO':fillValue,
-                'PO':fillValue,
-                'PI':fillValue,
-                'PT':fillValue,
-                'pH':fillValue,
-                'alk':fillValue,
-        }
+        job = {'source': layer.source(),
+               'band': band,
+               'srcWkt': layer.crs().toWkt(),
+               'xul': xul,
+               'yul': yul,
+               'csz': csz,
+               'cols': cols,
+               'fillValue': fillValue,
+               'window': window,
+               'compact': compact,
+               'maxError': maxError,
+               'extraVars': self.checkExtraVars(extraVars, layer, fillValue),
+               'topology': None}
+
+        # The topology is saved next to the output, where the serial export
+        # and the workers read it strip by strip
+        if topology:
+            if any(extra['column'] in TOPOLOGY_COLUMNS
+                   for extra in job['extraVars']):
+                raise RuntimeError("The destino and tramo columns cannot be "
+                                   "filled from other rasters when the "
+                                   "drainage topology is computed")
+            job['topology'] = {column: f'{txt}.{column}.npy'
+                               for column in TOPOLOGY_COLUMNS}
+            job['channelCells'] = channelCells
+
+            # A saved topology is only reused if it was computed for the
+            # same parameters, as recorded next to it
+            fingerprintPath = f'{txt}.topology.json'
+            saved = resume and \
+                readCheckpoint(fingerprintPath, job, 'topology') is not None \
+                and all(os.path.exists(path)
+                        for path in job['topology'].values())
+            if not saved:
+                if not self.computeTopology(layer, job, rows, feedback):
+                    return {self.OUTPUT: txt}
+                writeCheckpoint(fingerprintPath,
+                                {'kind': 'topology', 'job': job})
+
+        results = {self.OUTPUT: txt}
+        cellMap = None
+        if compact:
+            cellMap = os.path.splitext(txt)[0] + '_cells.csv'
+            results[self.CELLMAP] = cellMap
+
+        if workers > 0:
+            if layer.providerType() != 'gdal':
+                raise RuntimeError("The parallel export is only available "
+                                   "for raster layers read with GDAL")
+            completed = self.exportParallel(job, rows, workers, txt, cellMap,
+                                            resume, feedback)
+        else:
+            completed = self.exportSerial(layer, job, rows, txt, cellMap,
+                                          resume, feedback)
+
+        # The topology is kept for a resumed run until the export finishes
+        if completed and job['topology'] is not None:
+            for path in job['topology'].values():
+                os.remove(path)
+            os.remove(f'{txt}.topology.json')
+        return results
+
+    def computeTopology(self, layer, job, rows, feedback):
+        """Computes the destino and tramo columns and saves them to disk.
+
+        Returns False if the algorithm was cancelled.
+        """
+        feedback.pushInfo("Computing the drainage topology")
+        cols = job['cols']
+        window = job['window']
+        fillValue = job['fillValue']
+
+        # The flood needs the whole DEM, so it is read as a compact array
+        reader = ProviderStripReader(layer, job['band'])
+        z = np.empty((rows, cols))
+        valid = np.empty((rows, cols), dtype=bool)
+        for row0 in range(0, rows, window):
+            if feedback.isCanceled():
+                return False
+            nrows = min(window, rows - row0)
+            values, mask = reader.read(row0, nrows)
+            z[row0:row0 + nrows] = values
+            valid[row0:row0 + nrows] = ~mask
+        del reader, values, mask
+
+        result = drainageTopology(z, valid, job['channelCells'], feedback)
+        if result is None:
+            return False
+        dest, reach = result
+        del z
+
+        # Number the cells the way they are written to the matrix
+        if job['compact']:
+            number = np.cumsum(valid.ravel())
+        else:
+            number = np.arange(1, rows*cols + 1)
+        destino = np.where(dest >= 0, number[np.maximum(dest, 0)], 0)
+        destino = np.where(valid, destino, fillValue).astype(np.float64)
+        tramo = np.where(valid & (reach > 0), reach, fillValue)
+        np.save(job['topology']['destino'], destino)
+        np.save(job['topology']['tramo'], tramo.astype(np.float64))
+        return True
+
+    def checkExtraVars(self, matrix, layer, fillValue):
+        """Returns the rasters that fill other columns of the matrix.
+
+        matrix is the flat list of (column, raster, band) rows of the
+        'Variables from other rasters' parameter. A blank band is band 1.
+        Every raster must be aligned with the DEM.
+        """
+        columns = sigaVariables(fillValue)
+        extraVars = []
+        for i in range(0, len(matrix) - 2, 3):
+            column = str(matrix[i]).strip()
+            source = str(matrix[i + 1]).strip()
+            if column not in columns or column in DEM_COLUMNS:
+                raise RuntimeError(f"'{column}' in the 'Variables from other "
+                                   f"rasters' parameter is not a column "
+                                   f"that can be filled from a raster")
+            if column in (extra['column'] for extra in extraVars):
+                raise RuntimeError(f"The column '{column}' is repeated in "
+                                   f"the 'Variables from other rasters' "
+                                   f"parameter")
+            bandText = str(matrix[i + 2] if matrix[i + 2] is not None else '').strip()
+            try:
+                band = int(bandText) if bandText else 1
+            except ValueError:
+                raise RuntimeError(f"The raster '{source}' of the column "
+                                   f"'{column}' has no band {bandText}")
+            extraLayer = QgsRasterLayer(source)
+            if not extraLayer.isValid():
+                raise RuntimeError(f"The raster '{source}' of the column "
+                                   f"'{column}' could not be opened")
+            if band <= 0 or band > extraLayer.bandCount():
+                raise RuntimeError(f"The raster '{source}' of the column "
+                                   f"'{column}' has no band {band}")
+
+            # The rasters are read strip by strip along with the DEM, so
+            # they must share its grid, origin and pixel size
+            extent = layer.extent()
+            extraExtent = extraLayer.extent()
+            tolerance = min(layer.rasterUnitsPerPixelX(),
+                            layer.rasterUnitsPerPixelY()) / 2
+            if extraLayer.width() != layer.width() or \
+                    extraLayer.height() != layer.height() or \
+                    abs(extraExtent.xMinimum() - extent.xMinimum()) > tolerance or \
+                    abs(extraExtent.xMaximum() - extent.xMaximum()) > tolerance or \
+                    abs(extraExtent.yMinimum() - extent.yMinimum()) > tolerance or \
+                    abs(extraExtent.yMaximum() - extent.yMaximum()) > tolerance:
+                raise RuntimeError(f"The raster '{source}' of the column "
+                                   f"'{column}' is not aligned with the "
+                                   f"'Input layer' raster")
+            extraVars.append({'column': column,
+                              'source': extraLayer.source(),
+                              'band': band})
+        return extraVars
+
+    def exportSerial(self, layer, job, rows, txt, cellMap, resume, feedback):
+        """Exports the raster strip by strip in this process.
+
+        The next row to export and the size of the output files are saved
+        to a checkpoint every CHECKPOINT_SECONDS and when the export is
+        cancelled, so that a later run can resume from there.
+
+        Returns False if the algorithm was cancelled.
+        """
+        cols = job['cols']
+        window = job['window']
+        acl = job['csz'] ** 2
 
         # Compute the number of steps to display within the progress bar
-        total = 100.0 / ncls if ncls > 0 else 0
+        total = 100.0 / (rows * cols) if rows * cols > 0 else 0
 
-        with open(txt, 'w') as outputFile:
-            
-            # Write head block
-            line = f"[NÚMERO DE CELDAS]\n" \
-                   f"{ncls:0.0f}\n\n" \
-                   f"[ÁREA DE LAS CELDAS]\n" \
-                   f"{acl:0.2f}\n\n" \
-                   f"[TIPO DE TOPOLOGÍA]\n" \
-                   f"SIGA_CAL_V1.0\n\n" \
-                   f"[MATRIZ DE VARIABLES]\n"""
-            outputFile.write(line)
-            
-            # Write titles
-            line = ' '.join(key for key in vars.keys()) + '\n'
-            outputFile.write(line)
-            
-            # Start the counter of steps to display within the progress bar
+        reader = ProviderStripReader(layer, job['band'])
+        extraReaders = [ProviderStripReader(QgsRasterLayer(extra['source']),
+                                            extra['band'])
+                        for extra in job['extraVars']]
+        checkpointPath = txt + '.checkpoint'
+        checkpoint = readCheckpoint(checkpointPath, job, 'serial') \
+            if resume else None
+
+        if checkpoint is not None:
+            feedback.pushInfo(f"Resuming the export from row "
+                              f"{checkpoint['row']}")
+        else:
+            if resume:
+                feedback.pushInfo("No checkpoint matches these parameters, "
+                                  "the export starts from row 0")
+
+            # The head block needs the number of cells with data beforehand
+            ncls = rows * cols
+            if job['compact']:
+                ncls = 0
+                for row0 in range(0, rows, window):
+                    if feedback.isCanceled():
+                        return False
+                    values, mask = reader.read(row0, min(window, rows - row0))
+                    ncls += int(mask.size - np.count_nonzero(mask))
+            checkpoint = {'kind': 'serial',
+                          'job': job,
+                          'ncls': ncls,
+                          'row': 0,
+                          'written': 0,
+                          'offset': None,
+                          'mapOffset': None}
+
+        with ExitStack() as stack:
+            outputFile = stack.enter_context(
+                openForResume(txt, checkpoint['offset']))
+            exporter = StripExporter(outputFile, job)
+            if checkpoint['offset'] is None:
+                # Write head block and titles
+                outputFile.write(sigaHeader(checkpoint['ncls'], acl,
+                                            exporter.vars))
+            if cellMap is not None:
+                mapFile = stack.enter_context(
+                    openForResume(cellMap, checkpoint['mapOffset']))
+                mapWriter = cellMapWriter(mapFile,
+                                          checkpoint['mapOffset'] is None)
+
+            def saveCheckpoint():
+                outputFile.flush()
+                checkpoint['offset'] = outputFile.tell()
+                if cellMap is not None:
+                    mapFile.flush()
+                    checkpoint['mapOffset'] = mapFile.tell()
+                writeCheckpoint(checkpointPath, checkpoint)
+
+            # Read the band in strips of rows so that only one strip is held
+            # in memory at a time
+            lastSave = time.monotonic()
+            for row0 in range(checkpoint['row'], rows, window):
+                # Stop the algorithm if cancel button has been clicked
+                if feedback.isCanceled():
+                    break
+                
+                nrows = min(window, rows - row0)
+                values, mask = reader.read(row0, nrows)
+                extras = [extraReader.read(row0, nrows)
+                          for extraReader in extraReaders]
+                cells = exporter.export(row0, values, mask, extras)
+                
+                # Map the cells written to their rows and columns
+                if cellMap is not None:
+                    writeCellMap(mapWriter, checkpoint['written'] + 1, cells,
+                                 cols)
+                    checkpoint['written'] += cells.size
+                checkpoint['row'] = row0 + nrows
+                
+                if time.monotonic() - lastSave > CHECKPOINT_SECONDS:
+                    saveCheckpoint()
+                    lastSave = time.monotonic()
+                
+                # Update the progress bar
+                feedback.setProgress(int((row0 + nrows) * cols * total))
+
+            if checkpoint['row'] < rows:
+                saveCheckpoint()
+                return False
+
+        if os.path.exists(checkpointPath):
+            os.remove(checkpointPath)
+        return True
+
+    def exportParallel(self, job, rows, workers, txt, cellMap, resume,
+                       feedback):
+        """Exports bands of rows in worker processes and merges their parts.
+
+        Every worker writes its band to a part file next to the output, and
+        the parts are appended in row order after the head block. The cell
+        index map, if any, is written from the cells saved by the workers.
+        The finished bands are saved to a checkpoint, and their part files
+        are kept until the merge, so that a later run can resume.
+
+        Returns False if the algorithm was cancelled.
+        """
+        cols = job['cols']
+        acl = job['csz'] ** 2
+        total = 100.0 / (rows * cols) if rows * cols > 0 else 0
+        window = job['window']
+
+        # Split the raster in bands of whole windows, several per worker so
+        # that the progress bar moves smoothly and the load stays balanced
+        bandRows = -(-rows // (workers * 8))
+        bandRows = max(window, -(-bandRows // window) * window)
+
+        partsDir = txt + '.parts'
+        os.makedirs(partsDir, exist_ok=True)
+        jobs = []
+        for number, row0 in enumerate(range(0, rows, bandRows)):
+            jobs.append(dict(job,
+                             row0=row0,
+                             row1=min(row0 + bandRows, rows),
+                             partPath=os.path.join(partsDir,
+                                                   f'part{number:05d}.txt')))
+
+        # Skip the bands finished by a previous run
+        checkpointPath = txt + '.checkpoint'
+        checkpoint = readCheckpoint(checkpointPath, job, 'parallel') \
+            if resume else None
+        if checkpoint is None or checkpoint['bandRows'] != bandRows:
+            if resume:
+                feedback.pushInfo("No checkpoint matches these parameters, "
+                                  "the export starts from row 0")
+            checkpoint = {'kind': 'parallel', 'job': job,
+                          'bandRows': bandRows, 'done': {}}
+        done = checkpoint['done']
+        if done:
+            feedback.pushInfo(f"Resuming the export, {len(done)} of "
+                              f"{len(jobs)} bands are already written")
+
+        pool, manager = processPool(workers)
+        with pool, manager:
+            progress = manager.Queue()
+            cancel = manager.Event()
+            pending = {}
             current = 0
-            
-            for row in range(rows):
-                for col in range(cols):
-                    vars['X'] = xul + col*csz + csz/2
-                    vars['Y'] = yul - row*csz - csz/2
-                    vars['Z'] = block.value(row, col)
-                    point = QgsPoint(vars['X'], vars['Y'], vars['Z'])
-                    geom = QgsGeometry(point)
-                    geom.transform(tr)
-                    vars['lat'] = f"{geom.asPoint().y():0.6f}"
-                    vars['lon'] = f"{geom.asPoint().x():0.6f}"
-                    vars['X'] = f"{vars['X']:0.3f}"
-                    vars['Y'] = f"{vars['Y']:0.3f}"
-                    vars['Z'] = f"{vars['Z']:0.3f}"
-                    
-                    # Add a feature
-                    line = ' '.join(f'{vars[key]}' for key in vars.keys()) + '\n'
-                    outputFile.write(line)
-                    
-                    # Update the progress bar
-                    current += 1
-                    feedback.setProgress(int(current * total))
-                    
-        return {self.OUTPUT: txt}
+            for number, j in enumerate(jobs):
+                if str(number) in done:
+                    current += (j['row1'] - j['row0']) * cols
+                else:
+                    future = pool.submit(exportBand, j, progress, cancel)
+                    pending[future] = number
+            while pending:
+                finished, _ = wait(pending, timeout=0.5)
+                for future in finished:
+                    # Raise the errors of the workers in this process
+                    done[str(pending.pop(future))] = future.result()
+                    writeCheckpoint(checkpointPath, checkpoint)
+                while not progress.empty():
+                    current += progress.get()
+                feedback.setProgress(int(current * total))
+
+                # Stop the workers if cancel button has been clicked
+                if feedback.isCanceled():
+                    cancel.set()
+                    for future in pending:
+                        future.cancel()
+                    wait(pending)
+                    return False
+        ncls = sum(done.values())
+
+        # Join the head block and the parts in row order
+        with open(txt, 'w') as outputFile:
+            outputFile.write(sigaHeader(ncls, acl,
+                                        sigaVariables(job['fillValue'])))
+        with open(txt, 'ab') as outputFile:
+            for j in jobs:
+                with open(j['partPath'], 'rb') as partFile:
+                    shutil.copyfileobj(partFile, outputFile, BUFFER_SIZE)
+
+        # Number the cells with data in the same order
+        if cellMap is not None:
+            with open(cellMap, 'w', buffering=BUFFER_SIZE) as mapFile:
+                mapWriter = cellMapWriter(mapFile)
+                written = 0
+                for j in jobs:
+                    cells = np.load(j['partPath'] + '.npy')
+                    writeCellMap(mapWriter, written + 1, cells, cols)
+                    written += cells.size
+
+        shutil.rmtree(partsDir, ignore_errors=True)
+        if os.path.exists(checkpointPath):
+            os.remove(checkpointPath)
+        return True
 
     def name(self):
         return 'rastertobasin'
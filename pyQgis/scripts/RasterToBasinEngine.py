@@ -0,0 +1,528 @@
+# -*- coding: utf-8 -*-
+#
+# ***************************************************************************
+#     RasterToBasinEngine.py
+#     ----------------------
+#     Date                 : November 2022
+#     Copyright            : (C) 2022 by Gotta Ingeniería
+#     Email                : cristian.usma@gottaingenieria.com
+# ***************************************************************************
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation; either version 2 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# ***************************************************************************
+
+__author__ = 'Gotta Ingeniería'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2026, Gotta Ingeniería'
+
+import numpy as np
+from osgeo import gdal, osr
+try:
+    from pyproj import CRS, Transformer
+except ImportError:
+    Transformer = None
+
+# Size in bytes of the output file buffer
+BUFFER_SIZE = 8 * 1024 * 1024
+
+# Number of points sent at once to TransformPoints, which takes and returns
+# Python lists
+TRANSFORM_CHUNK = 65536
+
+# Columns of the SIGA variable matrix computed by the drainage topology
+TOPOLOGY_COLUMNS = ('destino', 'tramo')
+
+
+def nodataMask(values, nodata):
+    """Returns a mask that is True on the nodata cells of an array."""
+    mask = np.zeros(values.shape, dtype=bool)
+    if nodata is not None:
+        mask |= values == np.array(nodata).astype(values.dtype)
+    if np.issubdtype(values.dtype, np.floating):
+        mask |= np.isnan(values)
+    return mask
+
+
+class GdalStripReader:
+    """Reads strips of rows of a raster band with GDAL."""
+
+    def __init__(self, path, band):
+        self.dataset = gdal.Open(path)
+        if self.dataset is None:
+            raise RuntimeError(f"Could not open the raster '{path}'")
+        self.band = self.dataset.GetRasterBand(band)
+        self.nodata = self.band.GetNoDataValue()
+
+    def read(self, row0, nrows):
+        """Returns the values and nodata mask of nrows rows from row0."""
+        values = self.band.ReadAsArray(0, row0, self.dataset.RasterXSize,
+                                       nrows)
+        return values, nodataMask(values, self.nodata)
+
+
+class LatLonTransformer:
+    """Transforms arrays of projected coordinates to EPSG:4326."""
+    # Spacing in cells of the coarse lattice of the approximate transform
+    LATTICE_STEP = 64
+
+    def __init__(self, srcWkt):
+        srcSrs = osr.SpatialReference()
+        srcSrs.ImportFromWkt(srcWkt)
+        dstSrs = osr.SpatialReference()
+        dstSrs.ImportFromEPSG(4326)
+
+        # Keep the x/y (lon/lat) axis order regardless of the CRS definition
+        srcSrs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        dstSrs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        self.ct = osr.CoordinateTransformation(srcSrs, dstSrs)
+
+        # pyproj transforms NumPy arrays directly, when it is installed
+        self.proj = None
+        if Transformer is not None:
+            self.proj = Transformer.from_crs(CRS.from_wkt(srcWkt),
+                                             CRS.from_epsg(4326),
+                                             always_xy=True)
+
+    def transform(self, x, y):
+        """Returns the latitude and longitude arrays of the X/Y arrays.
+
+        Both inputs are broadcast against each other, so a row of X values
+        and a single Y value (or a column of Y values) can be passed as is.
+        Without pyproj the coordinates go to GDAL in chunks of
+        TRANSFORM_CHUNK points.
+        """
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64),
+                                   np.asarray(y, dtype=np.float64))
+        shape = x.shape
+        x = x.ravel()
+        y = y.ravel()
+        if self.proj is not None:
+            lon, lat = self.proj.transform(x, y)
+            return np.asarray(lat).reshape(shape), \
+                np.asarray(lon).reshape(shape)
+        lat = np.empty(x.size)
+        lon = np.empty(x.size)
+        for i in range(0, x.size, TRANSFORM_CHUNK):
+            coords = np.column_stack((x[i:i + TRANSFORM_CHUNK],
+                                      y[i:i + TRANSFORM_CHUNK]))
+            out = np.asarray(self.ct.TransformPoints(coords.tolist()))
+            lon[i:i + len(out)] = out[:, 0]
+            lat[i:i + len(out)] = out[:, 1]
+        return lat.reshape(shape), lon.reshape(shape)
+
+    def transformGrid(self, xs, ys, maxError=0):
+        """Returns the latitude and longitude arrays of a regular grid.
+
+        The grid has a row per value of ys and a column per value of xs.
+        With a positive maxError (in degrees) only a coarse lattice of
+        nodes is transformed exactly and the cells in between are
+        interpolated; the lattice is refined wherever the interpolation is
+        off by more than maxError.
+        """
+        lat = np.empty((len(ys), len(xs)))
+        lon = np.empty((len(ys), len(xs)))
+        if maxError > 0:
+            self._approximate(xs, ys, lat, lon, 0, len(ys), 0, len(xs),
+                              self.LATTICE_STEP, maxError)
+        else:
+            lat[:], lon[:] = self.transform(xs[np.newaxis, :],
+                                            ys[:, np.newaxis])
+        return lat, lon
+
+    def _approximate(self, xs, ys, lat, lon, r0, r1, c0, c1, step, maxError):
+        """Fills a window of the grid by interpolating a lattice of nodes."""
+        rowNodes = _latticeNodes(r0, r1, step)
+        colNodes = _latticeNodes(c0, c1, step)
+
+        # Small windows, and windows that keep failing the bound after a few
+        # refinements, are cheaper to transform exactly than to refine
+        # further, since the nodes and midpoints of a fine lattice are a
+        # large share of the window
+        if step < self.LATTICE_STEP // 4 or len(rowNodes) < 2 or \
+                len(colNodes) < 2 or \
+                rowNodes.size * colNodes.size * 2 >= (r1 - r0) * (c1 - c0):
+            lat[r0:r1, c0:c1], lon[r0:r1, c0:c1] = self.transform(
+                xs[np.newaxis, c0:c1], ys[r0:r1, np.newaxis])
+            return
+
+        # Interpolate the window from the exact values at the nodes
+        nodeLat, nodeLon = self.transform(xs[np.newaxis, colNodes],
+                                          ys[rowNodes, np.newaxis])
+        lat[r0:r1, c0:c1] = _interpolate(nodeLat, rowNodes, colNodes,
+                                         r0, r1, c0, c1)
+        lon[r0:r1, c0:c1] = _interpolate(nodeLon, rowNodes, colNodes,
+                                         r0, r1, c0, c1)
+
+        # Check the error at the middle cell of every lattice cell, where
+        # the bilinear interpolation of a smooth transform is worst
+        midRows = (rowNodes[:-1] + rowNodes[1:]) // 2
+        midCols = (colNodes[:-1] + colNodes[1:]) // 2
+        midLat, midLon = self.transform(xs[np.newaxis, midCols],
+                                        ys[midRows, np.newaxis])
+        error = np.maximum(
+            np.abs(midLat - lat[np.ix_(midRows, midCols)]),
+            np.abs(midLon - lon[np.ix_(midRows, midCols)]))
+        bad = error > maxError
+        if not bad.any():
+            return
+
+        # Refine the whole window at once if most lattice cells fail,
+        # otherwise only the lattice cells that fail
+        if np.count_nonzero(bad) * 2 > bad.size:
+            self._approximate(xs, ys, lat, lon, r0, r1, c0, c1, step // 2,
+                              maxError)
+            return
+        for i, j in zip(*np.nonzero(bad)):
+            self._approximate(xs, ys, lat, lon,
+                              rowNodes[i], rowNodes[i + 1] + 1,
+                              colNodes[j], colNodes[j + 1] + 1,
+                              step // 2, maxError)
+
+
+def _latticeNodes(start, stop, step):
+    """Returns the indices of the lattice nodes, both ends included."""
+    nodes = np.arange(start, stop, step)
+    if nodes[-1] != stop - 1:
+        nodes = np.append(nodes, stop - 1)
+    return nodes
+
+
+def _interpolate(values, rowNodes, colNodes, r0, r1, c0, c1):
+    """Bilinearly interpolates the node values over a window of cells."""
+    def weights(nodes, start, stop):
+        idx = np.arange(start, stop)
+        seg = np.clip(np.searchsorted(nodes, idx, 'right') - 1,
+                      0, len(nodes) - 2)
+        t = (idx - nodes[seg]) / (nodes[seg + 1] - nodes[seg])
+        return seg, t
+
+    rowSeg, rowT = weights(rowNodes, r0, r1)
+    colSeg, colT = weights(colNodes, c0, c1)
+    byCol = values[:, colSeg]*(1 - colT) + values[:, colSeg + 1]*colT
+    return byCol[rowSeg]*(1 - rowT[:, np.newaxis]) + \
+        byCol[rowSeg + 1]*rowT[:, np.newaxis]
+
+
+def sigaVariables(fillValue):
+    """Returns the columns of the SIGA variable matrix with their values."""
+    vars = {'tipo':0,
+            'destino':1,
+            'tramo':fillValue,
+            'llanura':fillValue,
+            'embalse':0,
+            'X':fillValue,
+            'Y':fillValue,
+            'Z':fillValue,
+            'lat':fillValue,
+            'lon':fillValue,
+            'L':fillValue,
+            'S':fillValue,
+            'D':fillValue,
+            'alfa1':fillValue,
+            'beta1':fillValue,
+            'S0':fillValue,
+            'S1':fillValue,
+            'S2':fillValue,
+            'S3':fillValue,
+            'S4':fillValue,
+            'S5':fillValue,
+            'H5b':fillValue,
+            'W5b':fillValue,
+            'Q5b':fillValue,
+            'HU':fillValue,
+            'LAI':fillValue,
+            'arcS2S':fillValue,
+            'limS2S':fillValue,
+            'areS2S':fillValue,
+            'arcS2D':fillValue,
+            'limS2D':fillValue,
+            'areS2D':fillValue,
+            'arcS5S':fillValue,
+            'limS5S':fillValue,
+            'areS5S':fillValue,
+            'arcS5D':fillValue,
+            'limS5D':fillValue,
+            'areS5D':fillValue,
+            'alfa2':fillValue,
+            'beta2':fillValue,
+            'alfa3':fillValue,
+            'beta3':fillValue,
+            'S0EC':fillValue,
+            'S1ECp':fillValue,
+            'S1ECs':fillValue,
+            'S2EC':fillValue,
+            'S3EC':fillValue,
+            'S4EC':fillValue,
+            'S0NO':fillValue,
+            'S1NOp':fillValue,
+            'S1NOs':fillValue,
+            'S2NO':fillValue,
+            'S3NO':fillValue,
+            'S4NO':fillValue,
+            'S0NH4':fillValue,
+            'S1NH4p':fillValue,
+            'S1NH4s':fillValue,
+            'S2NH4':fillValue,
+            'S3NH4':fillValue,
+            'S4NH4':fillValue,
+            'S0NO3':fillValue,
+            'S1NO3p':fillValue,
+            'S1NO3s':fillValue,
+            'S2NO3':fillValue,
+            'S3NO3':fillValue,
+            'S4NO3':fillValue,
+            'S0PO':fillValue,
+            'S1POp':fillValue,
+            'S1POs':fillValue,
+            'S2PO':fillValue,
+            'S3PO':fillValue,
+            'S4PO':fillValue,
+            'S0PI':fillValue,
+            'S1PIp':fillValue,
+            'S1PIs':fillValue,
+            'S2PI':fillValue,
+            'S3PI':fillValue,
+            'S4PI':fillValue,
+            'S0PO_fb':fillValue,
+            'S1POp_fb':fillValue,
+            'S1POs_fb':fillValue,
+            'S2PO_fb':fillValue,
+            'S3PO_fb':fillValue,
+            'S0PI_fb':fillValue,
+            'S1PIp_fb':fillValue,
+            'S1PIs_fb':fillValue,
+            'S2PI_fb':fillValue,
+            'S3PI_fb':fillValue,
+            'OD':fillValue,
+            'CDBO':fillValue,
+            'CE':fillValue,
+            'EC':fillValue,
+            'NO3':fillValue,
+            'NH4':fillValue,
+            'NO':fillValue,
+            'PO':fillValue,
+            'PI':fillValue,
+            'PT':fillValue,
+            'pH':fillValue,
+            'alk':fillValue,
+    }
+    return vars
+
+
+def sigaHeader(ncls, acl, vars):
+    """Returns the head block of a SIGA basin file and the column titles."""
+    return f"[NÚMERO DE CELDAS]\n" \
+           f"{ncls:0.0f}\n\n" \
+           f"[ÁREA DE LAS CELDAS]\n" \
+           f"{acl:0.2f}\n\n" \
+           f"[TIPO DE TOPOLOGÍA]\n" \
+           f"SIGA_CAL_V1.0\n\n" \
+           f"[MATRIZ DE VARIABLES]\n" \
+           + ' '.join(key for key in vars.keys()) + '\n'
+
+
+class SigaMatrixWriter:
+    """Writes the rows of the SIGA variable matrix in bulk.
+
+    The columns that keep the same value for every cell are rendered only
+    once into a line template, and the columns that change per cell are
+    formatted from arrays for many lines in a single operation.
+    """
+    # Number of lines formatted at once
+    CHUNK_LINES = 4096
+
+    def __init__(self, outputFile, vars, formats, separator=' '):
+        self.outputFile = outputFile
+        self.columns = [key for key in vars.keys() if key in formats]
+        fields = []
+        for key, value in vars.items():
+            if key in formats:
+                fields.append(formats[key])
+            else:
+                fields.append(f'{value}'.replace('%', '%%'))
+        self.template = separator.join(fields) + '\n'
+        self.chunkTemplate = self.template * self.CHUNK_LINES
+
+    def write(self, columns):
+        """Writes one line per cell.
+
+        columns maps every variable column to an array of values, all of
+        them with the same number of cells.
+        """
+        arrays = [np.ravel(columns[key]) for key in self.columns]
+        ncells = arrays[0].size
+        values = np.column_stack(arrays)
+        for start in range(0, ncells, self.CHUNK_LINES):
+            chunk = values[start:start + self.CHUNK_LINES]
+            if len(chunk) == self.CHUNK_LINES:
+                template = self.chunkTemplate
+            else:
+                template = self.template * len(chunk)
+            self.outputFile.write(template % tuple(chunk.ravel().tolist()))
+
+
+def cellMapWriter(mapFile, writeTitles=True):
+    """Returns a writer for the cell index map and writes its titles.
+
+    Every line of the map holds the number of a cell of the compacted
+    matrix and the row and column of the raster it comes from.
+    """
+    if writeTitles:
+        mapFile.write('cell,row,col\n')
+    return SigaMatrixWriter(mapFile,
+                            {'cell': 0, 'row': 0, 'col': 0},
+                            {'cell': '%d', 'row': '%d', 'col': '%d'},
+                            separator=',')
+
+
+def writeCellMap(writer, firstCell, cells, cols):
+    """Writes the map lines of the cells given by their flat indices."""
+    writer.write({'cell': firstCell + np.arange(len(cells)),
+                  'row': cells // cols,
+                  'col': cells % cols})
+
+
+class StripExporter:
+    """Writes strips of the DEM as rows of the SIGA variable matrix.
+
+    job is the dict of plain values that describes the export (see
+    RasterToBasinAlgorithm.processAlgorithm).
+    """
+
+    def __init__(self, outputFile, job):
+        fillValue = job['fillValue']
+        csz = job['csz']
+        self.vars = sigaVariables(fillValue)
+        self.extraColumns = [extra['column'] for extra in job['extraVars']]
+        formats = {'X': '%0.3f',
+                   'Y': '%0.3f',
+                   'Z': '%0.3f',
+                   'lat': '%0.6f',
+                   'lon': '%0.6f'}
+        formats.update((column, '%.7g') for column in self.extraColumns)
+        self.topology = None
+        if job['topology'] is not None:
+            formats.update((column, '%.15g') for column in TOPOLOGY_COLUMNS)
+            self.topology = {column: np.load(path, mmap_mode='r')
+                             for column, path in job['topology'].items()}
+        self.writer = SigaMatrixWriter(outputFile, self.vars, formats)
+        self.transformer = LatLonTransformer(job['srcWkt'])
+        self.yul = job['yul']
+        self.csz = csz
+        self.cols = job['cols']
+        self.fillValue = fillValue
+        self.compact = job['compact']
+        self.maxError = job['maxError']
+
+        # The X coordinates are the same for every row
+        self.xs = job['xul'] + np.arange(self.cols)*csz + csz/2
+
+    def export(self, row0, values, mask, extras=()):
+        """Writes the cells of a strip that starts at row row0.
+
+        extras holds the values and nodata mask of the same strip of every
+        raster in job['extraVars'], in the same order.
+
+        Returns the flat indices in the raster of the cells written when
+        only the cells with data are exported, otherwise None.
+        """
+        nrows = values.shape[0]
+        csz = self.csz
+        ys = self.yul - np.arange(row0, row0 + nrows)*csz - csz/2
+
+        # Transform the whole strip to geographic coordinates at once
+        if self.maxError > 0:
+            lats, lons = self.transformer.transformGrid(self.xs, ys,
+                                                        self.maxError)
+        elif not self.compact:
+            lats, lons = self.transformer.transformGrid(self.xs, ys)
+
+        if self.compact:
+            # Keep only the cells with data
+            rowIdx, colIdx = np.nonzero(~mask)
+            xs = self.xs[colIdx]
+            ys = ys[rowIdx]
+            zs = values[rowIdx, colIdx]
+            if self.maxError > 0:
+                lats = lats[rowIdx, colIdx]
+                lons = lons[rowIdx, colIdx]
+            else:
+                lats, lons = self.transformer.transform(xs, ys)
+        else:
+            # Take the whole strip, nodata cells get filled
+            xs = np.broadcast_to(self.xs, values.shape)
+            ys = np.broadcast_to(ys[:, np.newaxis], values.shape)
+            zs = np.where(mask, self.fillValue, values)
+
+        columns = {'X': xs,
+                   'Y': ys,
+                   'Z': zs,
+                   'lat': lats,
+                   'lon': lons}
+
+        # Sample the other rasters at the same cells
+        for column, (extraValues, extraMask) in zip(self.extraColumns,
+                                                    extras):
+            extraValues = np.where(extraMask, self.fillValue, extraValues)
+            if self.compact:
+                extraValues = extraValues[rowIdx, colIdx]
+            columns[column] = extraValues
+
+        # Take the drainage topology of the same cells
+        if self.topology is not None:
+            for column, topology in self.topology.items():
+                topology = topology[row0:row0 + nrows]
+                if self.compact:
+                    topology = topology[rowIdx, colIdx]
+                columns[column] = topology
+
+        self.writer.write(columns)
+
+        if self.compact:
+            return (row0 + rowIdx) * self.cols + colIdx
+        return None
+
+
+def exportBand(job, progress=None, cancel=None):
+    """Writes the rows of a band of the raster to its own part file.
+
+    This is the task run by each worker process of the parallel export, so
+    it only relies on GDAL and NumPy. job is a dict of plain values that
+    describes the raster, the band of rows and the part file. The number of
+    cells of every strip read is put on the progress queue, and the export
+    stops early when the cancel event is set.
+
+    Returns the number of cells written, or None if it was cancelled. When
+    only the cells with data are exported, their flat indices are saved to
+    the .npy file next to the part file for the cell index map.
+    """
+    reader = GdalStripReader(job['source'], job['band'])
+    extraReaders = [GdalStripReader(extra['source'], extra['band'])
+                    for extra in job['extraVars']]
+    ncells = 0
+    cells = []
+    with open(job['partPath'], 'w', buffering=BUFFER_SIZE) as partFile:
+        exporter = StripExporter(partFile, job)
+        for row0 in range(job['row0'], job['row1'], job['window']):
+            if cancel is not None and cancel.is_set():
+                return None
+            nrows = min(job['window'], job['row1'] - row0)
+            values, mask = reader.read(row0, nrows)
+            extras = [extraReader.read(row0, nrows)
+                      for extraReader in extraReaders]
+            written = exporter.export(row0, values, mask, extras)
+            if written is None:
+                ncells += values.size
+            else:
+                ncells += written.size
+                cells.append(written)
+            if progress is not None:
+                progress.put(values.size)
+    if job['compact']:
+        np.save(job['partPath'] + '.npy',
+                np.concatenate(cells) if cells else np.empty(0, np.int64))
+    return ncells
\ No newline at end of file
@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+#
+# ***************************************************************************
+#     RasterValuesFromPoints.py
+#     ----------------
+#     Date                 : November 2022
+#     Copyright            : (C) 2022 by Cristian Usma
+#     Email                : causmar97@gmail.com
+# ***************************************************************************
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation; either version 2 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# ***************************************************************************
+#     Instrucciones de uso como complemento para QGIS
+#     -----------------------------------------------
+#     1. Ubicar este archivo en la dirección adecuada según el OS:
+#         1.1. Windows:
+#             C:\Users\<usuario>\AppData\Roaming\QGIS\QGIS3\profiles\...
+#             ...<perfil>\processing\scripts\RasterValuesFromPoints.py
+#         1.2. Linux:
+#             /usr/local/share/QGIS/QGIS3/profiles/...
+#             ...<perfil>/processing/scripts/RasterValuesFromPoints.py
+#         1.3 macOS:
+#             Library/Application Support/QGIS/QGIS3/profiles/...
+#             ...<perfil>/processing/scripts/RasterValuesFromPoints.py
+#     2. Abrir QGIS normalmente.
+#     3. Abrir el panel de procesamiento. En la parte inferior abrir el
+#        ítem desplegable "Scripts" (identificado con el ícono de Python).
+#     4. Hacer doble click en el algoritmo "Raster Values From Points" e ingresar los
+#        parámetros normalmente a través de la interfaz gráfica de QGIS.
+#         4.1. Input layer: Capa raster que se muestrea (p. ej. el DEM).
+#         4.2. Band numbers: Bandas del raster que se muestrean. Cada banda
+#              se guarda en un campo o columna <prefijo><banda>.
+#         4.3. Point layer: Capa de puntos donde se muestrea el raster. De
+#              los multipuntos se usa el primer punto.
+#         4.4. Interpolation: Valor de la celda bajo el punto o interpolación
+#              bilineal entre los centros de las cuatro celdas más cercanas.
+#              Los puntos fuera del raster o sobre celdas sin datos quedan
+#              vacíos (NULL).
+#         4.5. Field prefix: Prefijo de los nombres de los campos nuevos.
+#         4.6. Sampled points: Capa de salida con los puntos y sus atributos
+#              más un campo por banda.
+#         4.7. CSV file: Archivo CSV opcional con el id, las coordenadas y
+#              los valores de cada punto.
+# ***************************************************************************
+
+__author__ = 'Cristian Usma'
+__date__ = 'November 2022'
+__copyright__ = '(C) 2022, Cristian Usma'
+
+import csv
+import numpy as np
+from osgeo import gdal, osr
+from PyQt5.QtCore import QCoreApplication, QVariant
+from qgis.core import (QgsProcessing,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterRasterLayer,
+                       QgsProcessingParameterBand,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterString,
+                       QgsProcessingParameterFeatureSink,
+                       QgsProcessingParameterFileDestination,
+                       QgsFeature,
+                       QgsFeatureRequest,
+                       QgsFeatureSink,
+                       QgsField,
+                       QgsFields)
+
+# Number of rows written to the CSV file at once
+CSV_CHUNK = 100000
+
+# Number of points sent at once to TransformPoints, which takes and returns
+# Python lists
+TRANSFORM_CHUNK = 65536
+
+
+def transformCoords(srcWkt, dstWkt, x, y):
+    """Transforms arrays of coordinates between two CRS, chunk by chunk."""
+    if x.size == 0 or not srcWkt or not dstWkt:
+        return x, y
+    srcSrs = osr.SpatialReference()
+    srcSrs.ImportFromWkt(srcWkt)
+    dstSrs = osr.SpatialReference()
+    dstSrs.ImportFromWkt(dstWkt)
+    if srcSrs.IsSame(dstSrs):
+        return x, y
+
+    # Keep the x/y axis order regardless of the CRS definitions
+    srcSrs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    dstSrs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    ct = osr.CoordinateTransformation(srcSrs, dstSrs)
+    tx = np.empty(x.size)
+    ty = np.empty(y.size)
+    for i in range(0, x.size, TRANSFORM_CHUNK):
+        coords = np.column_stack((x[i:i + TRANSFORM_CHUNK],
+                                  y[i:i + TRANSFORM_CHUNK]))
+        out = np.asarray(ct.TransformPoints(coords.tolist()))
+        tx[i:i + len(out)] = out[:, 0]
+        ty[i:i + len(out)] = out[:, 1]
+    return tx, ty
+
+
+def sampleBand(band, px, py, bilinear, feedback=None):
+    """Samples a band at fractional pixel coordinates, block by block.
+
+    The points are sorted by the native block of the band that holds them,
+    so every block is read once. With bilinear interpolation the window
+    read is one row and column larger than the block, to reach the
+    neighbouring cell centres. Points outside the band or on cells without
+    data get NaN. Returns None if cancelled.
+    """
+    rows, cols = band.YSize, band.XSize
+    blockX, blockY = band.GetBlockSize()
+    nBlocksX = -(-cols // blockX)
+    nodata = band.GetNoDataValue()
+    out = np.full(px.size, np.nan)
+
+    # Top left cell of the cells used by every point
+    if bilinear:
+        u = px - 0.5
+        v = py - 0.5
+        col = np.clip(np.floor(u), 0, max(cols - 2, 0))
+        row = np.clip(np.floor(v), 0, max(rows - 2, 0))
+        fx = np.clip(u - col, 0.0, 1.0)
+        fy = np.clip(v - row, 0.0, 1.0)
+    else:
+        col = np.floor(px)
+        row = np.floor(py)
+    inside = (px >= 0) & (px < cols) & (py >= 0) & (py < rows)
+    index = np.nonzero(inside)[0]
+    row = row[index].astype(np.int64)
+    col = col[index].astype(np.int64)
+
+    # Group the points by block
+    blockIds = (row // blockY) * nBlocksX + col // blockX
+    order = np.argsort(blockIds, kind='stable')
+    ids, starts = np.unique(blockIds[order], return_index=True)
+    ends = np.append(starts[1:], order.size)
+
+    for current, (blockId, start, end) in enumerate(zip(ids, starts, ends)):
+        if feedback is not None:
+            if feedback.isCanceled():
+                return None
+            feedback.setProgress(int(100.0 * current / len(ids)))
+        sel = order[start:end]
+        yoff = int(blockId // nBlocksX) * blockY
+        xoff = int(blockId % nBlocksX) * blockX
+        extra = 1 if bilinear else 0
+        width = min(blockX + extra, cols - xoff)
+        height = min(blockY + extra, rows - yoff)
+        data = band.ReadAsArray(xoff, yoff, width, height).astype(np.float64)
+        if nodata is not None:
+            data[data == nodata] = np.nan
+
+        r = row[sel] - yoff
+        c = col[sel] - xoff
+        if bilinear:
+            r1 = np.minimum(r + 1, height - 1)
+            c1 = np.minimum(c + 1, width - 1)
+            wx = fx[index[sel]]
+            wy = fy[index[sel]]
+            out[index[sel]] = (data[r, c] * (1 - wx) * (1 - wy) +
+                               data[r, c1] * wx * (1 - wy) +
+                               data[r1, c] * (1 - wx) * wy +
+                               data[r1, c1] * wx * wy)
+        else:
+            out[index[sel]] = data[r, c]
+    return out
+
+
+class RasterValuesFromPoints(QgsProcessingAlgorithm):
+    """Samples raster bands at the points of a vector layer."""
+    INPUT = 'INPUT'
+    BANDS = 'BANDS'
+    POINTS = 'POINTS'
+    INTERPOLATION = 'INTERPOLATION'
+    PREFIX = 'PREFIX'
+    OUTPUT = 'OUTPUT'
+    CSV = 'CSV'
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT,
+                self.tr('Input layer')
+            )
+        )
+        
+        self.addParameter(
+            QgsProcessingParameterBand(
+                self.BANDS,
+                self.tr('Band numbers'),
+                [1],
+                self.INPUT,
+                allowMultiple=True
+            )
+        )
+        
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.POINTS,
+                self.tr('Point layer'),
+                [QgsProcessing.TypeVectorPoint]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.INTERPOLATION,
+                self.tr('Interpolation'),
+                options=[self.tr('Cell under the point'),
+                         self.tr('Bilinear')],
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.PREFIX,
+                self.tr('Field prefix'),
+                defaultValue='band_'
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                self.tr('Sampled points'),
+                QgsProcessing.TypeVectorPoint,
+                optional=True
+            )
+        )
+
+        # We add an optional file output of type CSV.
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                self.CSV,
+                self.tr('CSV file'),
+                'CSV files (*.csv)',
+                optional=True,
+                createByDefault=False
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        layer = self.parameterAsRasterLayer(parameters, self.INPUT, context)
+        bands = self.parameterAsInts(parameters, self.BANDS, context)
+        source = self.parameterAsSource(parameters, self.POINTS, context)
+        bilinear = self.parameterAsEnum(parameters, self.INTERPOLATION, context) == 1
+        prefix = self.parameterAsString(parameters, self.PREFIX, context)
+        csvPath = self.parameterAsFileOutput(parameters, self.CSV, context)
+
+        # Load data
+        dataset = gdal.Open(layer.source())
+        if dataset is None:
+            raise RuntimeError("The layer specified in the 'Input layer' "\
+                "parameter can not be read with GDAL")
+        for band in bands:
+            if band <= 0 or band > dataset.RasterCount:
+                raise RuntimeError("The value specified in the 'Band numbers' "\
+                    "parameter does not match any existing band")
+
+        # Collect the coordinates of the points without their attributes
+        feedback.pushInfo('Reading points')
+        fids, xs, ys = [], [], []
+        request = QgsFeatureRequest().setNoAttributes()
+        for f in source.getFeatures(request):
+            if feedback.isCanceled():
+                return {}
+            geom = f.geometry()
+            fids.append(f.id())
+            if geom.isEmpty():
+                xs.append(np.nan)
+                ys.append(np.nan)
+            else:
+                point = geom.vertexAt(0)
+                xs.append(point.x())
+                ys.append(point.y())
+        fids = np.array(fids, dtype=np.int64)
+        x = np.array(xs, dtype=np.float64)
+        y = np.array(ys, dtype=np.float64)
+        del xs, ys
+
+        # Pixel coordinates of the points, transformed to the raster's CRS at once
+        gx, gy = transformCoords(source.sourceCrs().toWkt(),
+                                 dataset.GetProjection(), x, y)
+        inv = gdal.InvGeoTransform(dataset.GetGeoTransform())
+        px = inv[0] + inv[1] * gx + inv[2] * gy
+        py = inv[3] + inv[4] * gx + inv[5] * gy
+        del gx, gy
+
+        # Sample every band block by block
+        samples = []
+        for band in bands:
+            feedback.pushInfo(f'Sampling band {band}')
+            values = sampleBand(dataset.GetRasterBand(band), px, py,
+                                bilinear, feedback)
+            if values is None:
+                return {}
+            samples.append(values)
+        dataset = None
+        names = [f'{prefix}{band}' for band in bands]
+        results = {}
+
+        # Copy the points to the sink with a field per band
+        fields = QgsFields(source.fields())
+        for name in names:
+            fields.append(QgsField(name, QVariant.Double))
+        sink, destId = self.parameterAsSink(parameters, self.OUTPUT, context,
+                                            fields, source.wkbType(),
+                                            source.sourceCrs())
+        if sink is not None:
+            feedback.pushInfo('Writing sampled points')
+            order = np.argsort(fids)
+            sortedFids = fids[order]
+            total = 100.0 / fids.size if fids.size else 0
+            for current, f in enumerate(source.getFeatures()):
+                if feedback.isCanceled():
+                    return {}
+                i = order[np.searchsorted(sortedFids, f.id())]
+                out = QgsFeature(fields)
+                out.setGeometry(f.geometry())
+                out.setAttributes(f.attributes() +
+                                  [None if np.isnan(values[i]) else float(values[i])
+                                   for values in samples])
+                sink.addFeature(out, QgsFeatureSink.FastInsert)
+                feedback.setProgress(int(current * total))
+            results[self.OUTPUT] = destId
+
+        # Write the CSV file in chunks of rows
+        if csvPath:
+            feedback.pushInfo('Writing CSV file')
+            with open(csvPath, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['fid', 'x', 'y'] + names)
+                for start in range(0, fids.size, CSV_CHUNK):
+                    if feedback.isCanceled():
+                        return {}
+                    chunk = slice(start, start + CSV_CHUNK)
+                    columns = [fids[chunk].tolist(), x[chunk].tolist(),
+                               y[chunk].tolist()] + \
+                              [values[chunk].tolist() for values in samples]
+                    writer.writerows(['' if v != v else v for v in row]
+                                     for row in zip(*columns))
+            results[self.CSV] = csvPath
+
+        return results
+
+    def name(self):
+        return 'rastervaluesfrompoints'
+
+    def displayName(self):
+        return self.tr('Raster Values From Points')
+
+    def group(self):
+        return self.tr(self.groupId())
+
+    def groupId(self):
+        return ''
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return RasterValuesFromPoints()
\ No newline at end of file